@@ -0,0 +1,251 @@
+# Asyncio version of final_eval_server_5moves: one server process evaluating several groups at once.
+# Every group gets its own port (base port + position in --groups) and key. Action timeouts run on the event loop
+# and log rows go through a queue to one writer task that appends them to log<groupID>.csv in batches.
+#
+# python async_eval_server.py [IP address] [Base port] --groups 1=<key> 2=<key> ... [--simulate]
+import argparse
+import asyncio
+import base64
+import os
+import random
+import sys
+import time
+
+from Crypto.Cipher import AES
+
+from server_auth import StreamDecoder, server_auth
+from session_log import SessionLog
+
+# Same move set as final_eval_server_5moves
+ACTIONS = ['hunchback', 'raffles', 'chicken', 'crab', 'cowboy', 'runningman', 'jamesbond', 'snake', 'doublepump',
+           'mermaid']
+REPEATS = 4
+
+
+class LogWriter:
+    """Collects log rows from every group and writes them to the per group session logs in batches"""
+    def __init__(self, batch_size=64, flush_interval=1.0, npz=False):
+        self.rows = asyncio.Queue()
+        self.npz = npz
+        self.session_logs = {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+
+    def log(self, group_id, row):
+        self.rows.put_nowait((group_id, row))
+
+    async def run(self):
+        # A None row is the sentinel to write out what is left and stop
+        loop = asyncio.get_running_loop()
+        running = True
+        while running:
+            batch = []
+            try:
+                batch.append(await asyncio.wait_for(self.rows.get(), self.flush_interval))
+            except asyncio.TimeoutError:
+                continue
+            while len(batch) < self.batch_size and not self.rows.empty():
+                batch.append(self.rows.get_nowait())
+            if batch[-1] is None:
+                running = False
+            batch = [item for item in batch if item is not None]
+            if batch:
+                await loop.run_in_executor(None, self.write_rows, batch)
+
+    def write_rows(self, batch):
+        touched = set()
+        for group_id, row in batch:
+            if group_id not in self.session_logs:
+                # Flushed after every batch below, so no background flushing
+                self.session_logs[group_id] = SessionLog("log" + str(group_id) + ".csv", npz=self.npz,
+                                                         flush_interval=None)
+            self.session_logs[group_id].append(**row)
+            touched.add(group_id)
+        for group_id in touched:
+            self.session_logs[group_id].flush()
+        self.rows_written += len(batch)
+
+    async def close(self, task):
+        self.rows.put_nowait(None)
+        await task
+
+
+class GroupSession:
+    """Action sequence, timeouts and logging of one group; outlives reconnects of the group's Pi"""
+    def __init__(self, group_id, key, log_writer, timeout=30, start_delay=30):
+        self.group_id = group_id
+        self.key = key
+        self.log_writer = log_writer
+        self.timeout = timeout
+        self.start_delay = start_delay
+        self.auth = server_auth()
+        self.actions = [action for action in ACTIONS for _ in range(REPEATS)]
+        self.n_moves = len(self.actions)
+        self.indices = list(range(self.n_moves))
+        random.shuffle(self.indices)
+        self.action = None
+        self.action_set_time = None
+        self.x = 0
+        self.responded = asyncio.Event()
+        self.done = asyncio.Event()
+        self.connections = 0
+
+    async def run_actions(self):
+        # Waits start_delay after the first connection, then hands out actions; an action not answered within
+        # timeout is logged as "None"
+        await self.connected()
+        try:
+            await asyncio.wait_for(self.done.wait(), self.start_delay)
+            return
+        except asyncio.TimeoutError:
+            pass
+        while not self.done.is_set():
+            self.next_action()
+            try:
+                await asyncio.wait_for(self.responded.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                if not self.done.is_set():
+                    self.log_move_made("None", 0, 0, 0, 0)
+                    print("[{}] ACTION TIMEOUT".format(self.group_id))
+
+    async def connected(self):
+        while self.connections == 0 and not self.done.is_set():
+            await asyncio.sleep(0.1)
+
+    def next_action(self):
+        index = self.indices[self.x] if self.x < self.n_moves else self.n_moves - 1
+        self.action = self.actions[index]
+        self.x += 1
+        self.action_set_time = time.time()
+        self.responded.clear()
+        print("[{}] NEW ACTION :: {}".format(self.group_id, self.action))
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        print('[{}] connection from {}'.format(self.group_id, client_address), file=sys.stderr)
+        self.connections += 1
+        decoder = StreamDecoder()
+        try:
+            while not self.done.is_set():
+                data = await reader.read(1024)
+                if not data:
+                    print('[{}] no more data from {}'.format(self.group_id, client_address), file=sys.stderr)
+                    if self.x >= self.n_moves:
+                        self.done.set()
+                    break
+                for msg in decoder.feed(data):
+                    try:
+                        for decodedmsg in self.auth.decryptBatch(msg.decode("utf8"), self.key):
+                            self.handle_result(decodedmsg)
+                    except Exception as e:
+                        print(e)
+        finally:
+            writer.close()
+
+    def handle_result(self, decodedmsg):
+        if decodedmsg['action'] == "logout":
+            print("[{}] bye bye".format(self.group_id))
+            self.done.set()
+            self.responded.set()  # Wakes run_actions
+        elif len(decodedmsg['action']) == 0 or self.action is None or self.responded.is_set():
+            pass  # Nothing to log, no action set yet, or this action was already answered
+        else:
+            self.log_move_made(decodedmsg['action'], decodedmsg['voltage'], decodedmsg['current'],
+                               decodedmsg['power'], decodedmsg['cumpower'])
+            print("[{}] {} :: {} :: {} :: {} :: {}".format(self.group_id, decodedmsg['action'], decodedmsg['voltage'],
+                                                           decodedmsg['current'], decodedmsg['power'],
+                                                           decodedmsg['cumpower']))
+            self.responded.set()
+
+    def log_move_made(self, action_made, voltage, current, power, cumpower):
+        timestamp = time.time()
+        self.log_writer.log(self.group_id, {
+            'timestamp': timestamp, 'action': action_made, 'goal': self.action,
+            'time_delta': timestamp - self.action_set_time, 'correct': self.action == action_made,
+            'voltage': voltage, 'current': current, 'power': power, 'cumpower': cumpower})
+
+
+def encrypt_result(message, key):
+    """Encrypts a result the way the Pi does ('0' padded, AES-CBC, IV prepended, base64, newline framed; the Pi also
+    opens the connection with StreamDecoder.FRAMING_MARKER)"""
+    padded = (message + "0" * (16 - (len(message) % 16))).encode()
+    iv = os.urandom(AES.block_size)
+    return base64.b64encode(iv + AES.new(key.encode(), AES.MODE_CBC, iv).encrypt(padded)) + b'\n'
+
+
+async def simulate_client(session, ip_addr, port_num, accuracy=0.9, reaction=(0.5, 2.0)):
+    """Fake Pi for stress tests: answers every action after a random reaction time, correctly with given accuracy"""
+    reader, writer = await asyncio.open_connection(ip_addr, port_num)
+    writer.write(StreamDecoder.FRAMING_MARKER)
+    goal_number = 0  # Number of the last action answered
+    while goal_number < session.n_moves:
+        while session.x == goal_number or session.responded.is_set():
+            await asyncio.sleep(0.01)
+        goal_number = session.x
+        await asyncio.sleep(random.uniform(*reaction))
+        if session.x != goal_number:
+            continue  # Timed out in the meantime
+        action = session.action if random.random() < accuracy else random.choice(ACTIONS)
+        writer.write(encrypt_result("#{}|5.0|1.0|5.0|{:.3f}|".format(action, goal_number * 0.01), session.key))
+        await writer.drain()
+    while session.x == goal_number and not session.responded.is_set():
+        await asyncio.sleep(0.01)
+    writer.write(encrypt_result("#logout|0|0|0|0|", session.key))
+    await writer.drain()
+    writer.close()
+
+
+async def serve(ip_addr, base_port, groups, timeout, start_delay, simulate=False, reaction=(0.5, 2.0), npz=False):
+    log_writer = LogWriter(npz=npz)
+    writer_task = asyncio.create_task(log_writer.run())
+    sessions = []
+    servers = []
+    tasks = []
+    for position, (group_id, key) in enumerate(groups):
+        session = GroupSession(group_id, key, log_writer, timeout, start_delay)
+        port_num = base_port + position
+        servers.append(await asyncio.start_server(session.handle_connection, ip_addr, port_num))
+        print('[{}] starting up on {} port {}'.format(group_id, ip_addr, port_num), file=sys.stderr)
+        sessions.append(session)
+        tasks.append(asyncio.create_task(session.run_actions()))
+        if simulate:
+            tasks.append(asyncio.create_task(simulate_client(session, ip_addr, port_num, reaction=reaction)))
+    start_time = time.time()
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        await log_writer.close(writer_task)
+    elapsed = time.time() - start_time
+    print("{} groups, {} rows logged in {:.2f}s".format(len(sessions), log_writer.rows_written, elapsed))
+
+
+def parse_group(text):
+    group_id, _, key = text.partition('=')
+    if len(key) not in (16, 24, 32):
+        raise argparse.ArgumentTypeError("AES key of group " + group_id + " must be either 16, 24, or 32 bytes long")
+    return group_id, key
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ip_addr', help="IP address to listen on")
+    parser.add_argument('base_port', type=int, help="Port of the first group, the next group gets the next port")
+    parser.add_argument('-g', '--groups', type=parse_group, nargs='+', required=True,
+                        help="groupID=key for every group, e.g. 1=0123456789abcdef")
+    parser.add_argument('-t', '--timeout', type=float, default=30, help="Seconds before an action times out")
+    parser.add_argument('-d', '--start_delay', type=float, default=30,
+                        help="Seconds between a group connecting and its first action")
+    parser.add_argument('-s', '--simulate', action='store_true', help="Connect a simulated Pi for every group")
+    parser.add_argument('-r', '--reaction', type=float, nargs=2, default=[0.5, 2.0],
+                        help="Min and max reaction time of simulated Pis")
+    parser.add_argument('--npz', action='store_true', help="Also write every log as .npz column arrays")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.ip_addr, args.base_port, args.groups, args.timeout, args.start_delay, args.simulate,
+                          tuple(args.reaction), args.npz))
+    except KeyboardInterrupt:
+        pass
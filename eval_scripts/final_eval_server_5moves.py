@@ -4,8 +4,6 @@
 
 
 
-import os
-
 import random
 
 import socket
@@ -22,11 +20,12 @@ from tkinter import Label, Tk
 
 import numpy as np
 
-import pandas as pd
 
 
 
-from server_auth import server_auth
+from server_auth import StreamDecoder, server_auth
+
+from session_log import SessionLog
 
 
 
@@ -34,7 +33,7 @@ from server_auth import server_auth
 
 class Server(threading.Thread):
 
-    def __init__(self, ip_addr, port_num):
+    def __init__(self, ip_addr, port_num, npz=False):
 
         threading.Thread.__init__(self)
 
@@ -46,6 +45,8 @@ class Server(threading.Thread):
 
         self.auth = server_auth()
 
+        self.decoder = StreamDecoder()
+
         # Create a TCP/IP socket
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -90,13 +91,9 @@ class Server(threading.Thread):
 
         self.filename = "logServer.csv"
 
-        self.columns = ['timestamp', 'action', 'goal', 'time_delta', 'correct', 'voltage', 'current', 'power',
-
-                        'cumpower']
+        self.npz = npz
 
-        self.df = pd.DataFrame(columns=self.columns)
-
-        self.df = self.df.set_index('timestamp')
+        self.session_log = None  # Opened on the first move, rows are written out in batches
 
         self.action = None
 
@@ -168,47 +165,45 @@ class Server(threading.Thread):
 
             if data:
 
-                try:
-                    msg = data.decode("utf8")
-
-                    decodedmsg = self.auth.decryptText(msg, secret_key)
-
+                for msg in self.decoder.feed(data):  # Framed stream may hold several or partial messages per recv
 
+                    try:
+                        for decodedmsg in self.auth.decryptBatch(msg.decode("utf8"), secret_key):
 
-                    if decodedmsg['action'] == "logout":
+                            if decodedmsg['action'] == "logout":
 
-                        self.logout = True
+                                self.logout = True
 
-                        print("bye bye")
+                                print("bye bye")
 
-                        self.stop()
+                                self.stop()
 
-                    elif len(decodedmsg['action']) == 0:
+                            elif len(decodedmsg['action']) == 0:
 
-                        pass
+                                pass
 
-                    elif self.action is None:  # Ignore if no action has been set yet
+                            elif self.action is None:  # Ignore if no action has been set yet
 
-                        pass
+                                pass
 
-                    else:  # If action is available log it, and then...
+                            else:  # If action is available log it, and then...
 
-                        self.no_response = False
+                                self.no_response = False
 
-                        self.log_move_made(decodedmsg['action'], decodedmsg['voltage'], decodedmsg['current'],
+                                self.log_move_made(decodedmsg['action'], decodedmsg['voltage'], decodedmsg['current'],
 
-                                           decodedmsg['power'], decodedmsg['cumpower'])
+                                                   decodedmsg['power'], decodedmsg['cumpower'])
 
-                        print("{} :: {} :: {} :: {} :: {}".format(decodedmsg['action'], decodedmsg['voltage'],
+                                print("{} :: {} :: {} :: {} :: {}".format(decodedmsg['action'], decodedmsg['voltage'],
 
-                                                                  decodedmsg['current'], decodedmsg['power'],
+                                                                          decodedmsg['current'], decodedmsg['power'],
 
-                                                                  decodedmsg['cumpower']))
+                                                                          decodedmsg['cumpower']))
 
-                        self.get_action()  # Get new action
+                                self.get_action()  # Get new action
 
-                except Exception as e:
-                    print(e)
+                    except Exception as e:
+                        print(e)
 
             else:
 
@@ -220,11 +215,19 @@ class Server(threading.Thread):
 
     def stop(self):
 
-        self.connection.close()
+        if self.connection is not None:
+
+            self.connection.close()
 
         self.shutdown.set()
 
-        self.timer.cancel()
+        if self.timer is not None:
+
+            self.timer.cancel()
+
+        if self.session_log is not None:
+
+            self.session_log.close()
 
 
 
@@ -266,39 +269,15 @@ class Server(threading.Thread):
 
     def log_move_made(self, action_made, voltage, current, power, cumpower):
 
-        file = "log" + str(groupID) + ".csv"
-
-        if not os.path.isfile(file):
+        if self.session_log is None:
 
-            with open(file, 'w') as f:
+            self.session_log = SessionLog("log" + str(groupID) + ".csv", npz=self.npz)
 
-                self.df.to_csv(f)
+        timestamp = time.time()
 
-        with open(file, 'a') as f:
+        self.session_log.append(timestamp, action_made, self.action, timestamp - self.action_set_time,
 
-            data = dict()
-
-            data['timestamp'] = time.time()
-
-            data['action'] = action_made
-
-            data['goal'] = self.action
-
-            data['time_delta'] = data['timestamp'] - self.action_set_time
-
-            data['voltage'] = voltage
-
-            data['current'] = current
-
-            data['power'] = power
-
-            data['cumpower'] = cumpower
-
-            data['correct'] = (self.action == action_made)
-
-            self.df = pd.DataFrame(data, index=[0])[self.columns].set_index('timestamp')
-
-            self.df.to_csv(f, header=False)
+                                self.action == action_made, voltage, current, power, cumpower)
 
 
 
@@ -306,11 +285,11 @@ class Server(threading.Thread):
 
 if __name__ == '__main__':
 
-    if len(sys.argv) != 4:
+    if len(sys.argv) not in (4, 5) or (len(sys.argv) == 5 and sys.argv[4] != '--npz'):
 
         print('Invalid number of arguments')
 
-        print('python server.py [IP address] [Port] [groupID]')
+        print('python server.py [IP address] [Port] [groupID] [--npz]')
 
         sys.exit()
 
@@ -330,7 +309,7 @@ if __name__ == '__main__':
 
 
 
-    my_server = Server(ip_addr, port_num)
+    my_server = Server(ip_addr, port_num, npz=len(sys.argv) == 5)
 
     my_server.start()
 
@@ -346,6 +325,8 @@ if __name__ == '__main__':
 
     display_label.pack(expand=True)
 
+    display_window.protocol("WM_DELETE_WINDOW", my_server.stop)  # Closing the window ends the session, log written out
+
     display_window.update()
 
 
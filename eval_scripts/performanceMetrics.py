@@ -6,93 +6,214 @@ This is a temporary script file.
 """
 
 from __future__ import division
+import argparse
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
-import sys
-
-
-
-feature_columns = ['timestamp','action','goal','time_delta','correct','voltage','current','power']
-
-def read_data(file_path):
-    columns = ['timestamp','action','goal','time_delta','correct','voltage','current','power']
-    data = pd.read_csv(file_path)
-    data = data[columns]
-    return data
-
-def calcuateMeanTime(logData):
-    timeDelay = logData["time_delta"]
-    #print (np.mean(timeDelay))
-    return np.mean(timeDelay)
-
-def calculateMedianTime(logData):
-    timeDelay = logData["time_delta"]
-    #print np.median(timeDelay);
-    return np.median(timeDelay)
-
-def calculateMaxTime(logData):
-    timeDelay = logData["time_delta"]
-    #print np.max(timeDelay);
-    return np.max(timeDelay)
-
-def calculateMinTime(logData):
-    timeDelay = logData["time_delta"]
-    #print np.min(timeDelay);
-    return np.min(timeDelay)
-
-def percentageAccuracy(logData):
-    correct = logData["correct"]
-    correctIdentify = np.count_nonzero(correct == 1)
-    falseIdentify = np.count_nonzero(correct == 0)
-    percentAccuracy = correctIdentify/(correctIdentify+falseIdentify)*100
-    #print percentAccuracy
-    return percentAccuracy
-
-def calculateMeanPower(logData):
-    power = logData["power"]
-    return np.mean(power)
-
-def calculateMeanCurrent(logData):
-    current = logData["current"]
-    return np.mean(current)
-
-def calculateMeanVoltage(logData):
-    voltage = logData["voltage"]
-    return np.mean(voltage)
-    
+
+
+class QuantileSketch:
+    """Streaming quantiles with relative error alpha: values are counted in logarithmic buckets. Sketches of
+    different chunks / sessions merge by adding bucket counts, so the result does not depend on the split."""
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.logGamma = np.log(self.gamma)
+        self.buckets = {}
+        self.nonPositive = []  # Zero / negative values are rare here and kept exactly
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        positive = values[values > 0]
+        self.nonPositive.extend(values[values <= 0].tolist())
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.logGamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.nonPositive.extend(other.nonPositive)
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        nonPositive = sorted(self.nonPositive)
+        if rank < len(nonPositive):
+            return nonPositive[int(rank)]
+        seen = len(nonPositive)
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)  # Bucket midpoint, within alpha of every value in it
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class ColumnStats:
+    """Exact count / sum / min / max of one column"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += values.sum()
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else np.nan
+
+
+class SessionMetrics:
+    """Every statistic of the report, accumulated chunk by chunk in one pass and mergeable across sessions"""
+    def __init__(self):
+        self.sessions = 0
+        self.moves = 0
+        self.timeDelta = ColumnStats()
+        self.timeSketch = QuantileSketch()
+        self.voltage = ColumnStats()
+        self.current = ColumnStats()
+        self.power = ColumnStats()
+        self.goalCounts = {}  # goal -> [correct, total]
+        self.confusion = {}  # (goal, action) -> count
+
+    def update(self, chunk):
+        self.moves += len(chunk)
+        self.timeDelta.update(chunk["time_delta"])
+        self.timeSketch.update(chunk["time_delta"])
+        self.voltage.update(pd.to_numeric(chunk["voltage"], errors='coerce'))
+        self.current.update(pd.to_numeric(chunk["current"], errors='coerce'))
+        self.power.update(pd.to_numeric(chunk["power"], errors='coerce'))
+        correct = chunk["correct"].astype(str).isin(['True', '1', '1.0'])
+        goals = chunk["goal"].astype(str)
+        for goal, goalCorrect in correct.groupby(goals):
+            counts = self.goalCounts.setdefault(goal, [0, 0])
+            counts[0] += int(goalCorrect.sum())
+            counts[1] += len(goalCorrect)
+        for (goal, action), count in chunk.groupby([goals, chunk["action"].astype(str)]).size().items():
+            self.confusion[(goal, action)] = self.confusion.get((goal, action), 0) + int(count)
+
+    def merge(self, other):
+        self.sessions += other.sessions
+        self.moves += other.moves
+        for name in ['timeDelta', 'voltage', 'current', 'power']:
+            getattr(self, name).merge(getattr(other, name))
+        self.timeSketch.merge(other.timeSketch)
+        for goal, (goalCorrect, total) in other.goalCounts.items():
+            counts = self.goalCounts.setdefault(goal, [0, 0])
+            counts[0] += goalCorrect
+            counts[1] += total
+        for pair, count in other.confusion.items():
+            self.confusion[pair] = self.confusion.get(pair, 0) + count
+
+    def accuracy(self):
+        total = sum(counts[1] for counts in self.goalCounts.values())
+        return sum(counts[0] for counts in self.goalCounts.values()) / total * 100 if total > 0 else np.nan
+
+
+def readChunks(file_path, chunkSize):
+    """Yields a session log in DataFrame chunks of at most chunkSize rows (.csv or .npz)"""
+    if file_path.endswith('.npz'):
+        with np.load(file_path) as logArrays:
+            columns = {column: logArrays[column] for column in logArrays.files}
+        rows = len(columns['time_delta'])
+        for start in range(0, rows, chunkSize):
+            yield pd.DataFrame({column: values[start:start + chunkSize] for column, values in columns.items()})
+    else:
+        # Timed out moves are logged with action "None", which must stay a string
+        for chunk in pd.read_csv(file_path, chunksize=chunkSize, keep_default_na=False, na_values=['']):
+            yield chunk
+
+
+def summarizeSession(file_path, chunkSize=4096):
+    metrics = SessionMetrics()
+    metrics.sessions = 1
+    for chunk in readChunks(file_path, chunkSize):
+        metrics.update(chunk)
+    return metrics
+
+
+def aggregateSessions(file_paths, chunkSize=4096, processes=None):
+    """Summarizes every session log, in parallel across processes, and merges the results"""
+    total = SessionMetrics()
+    if processes == 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            total.merge(summarizeSession(file_path, chunkSize))
+        return total
+    with ProcessPoolExecutor(processes) as pool:
+        for metrics in pool.map(summarizeSession, file_paths, [chunkSize] * len(file_paths)):
+            total.merge(metrics)
+    return total
+
+
+def expandPaths(patterns):
+    file_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        file_paths.extend(matches if matches else [pattern])
+    return file_paths
+
+
+def printReport(metrics, percentiles):
+    print('Sessions:                '+ str(metrics.sessions))
+    print('Moves:                   '+ str(metrics.moves))
+    print('Mean Time:               '+ str(metrics.timeDelta.mean()))
+    print('Median Time:             '+ str(metrics.timeSketch.quantile(0.5)) + ' (approx.)')
+    print('MaxDelay:           '+ str(metrics.timeDelta.maximum))
+    print('MinDelay:           '+ str(metrics.timeDelta.minimum))
+    for percentile in percentiles:
+        print('P{:<4g} Time:              '.format(percentile) + str(metrics.timeSketch.quantile(percentile / 100.0)))
+    print('PercentAccuracy:    '+ str(metrics.accuracy()))
+    print('meanVoltage:    '+ str(metrics.voltage.mean()))
+    print('meanCurrent:    '+ str(metrics.current.mean()))
+    print('meanPower:    '+ str(metrics.power.mean()))
+
+    print('\nAccuracy per goal:')
+    for goal in sorted(metrics.goalCounts):
+        goalCorrect, total = metrics.goalCounts[goal]
+        print('    {:<12} {:>6.1f}%  ({}/{})'.format(goal, goalCorrect / total * 100, goalCorrect, total))
+
+    goals = sorted(metrics.goalCounts)
+    actions = sorted(set(action for _, action in metrics.confusion) | set(goals))
+    print('\nConfusion matrix (rows: goal, columns: action made):')
+    print(' ' * 12 + ''.join('{:>11}'.format(action[:10]) for action in actions))
+    for goal in goals:
+        print('{:<12}'.format(goal[:12]) + ''.join('{:>11}'.format(metrics.confusion.get((goal, action), 0))
+                                                    for action in actions))
+
+
 def main():
-#    file_path='log.csv'
-    file_path=sys.argv[1]
-    dataset = read_data(file_path)
-    data = dataset[feature_columns]
-    logData = pd.DataFrame(data, columns=feature_columns)
-    
-    meanTime = calcuateMeanTime(logData)
-    print('Mean Time:               '+ str(meanTime))
-    
-    medianTime = calculateMedianTime(logData)
-    print('Median Time:             '+ str(medianTime))
-    
-    maxDelay = calculateMaxTime(logData)
-    print('MaxDelay:           '+ str(maxDelay))
-    
-    minDelay = calculateMinTime(logData)
-    print('MinDelay:           '+ str(minDelay))
-    
-    percentAccuracy=percentageAccuracy(logData)
-    print('PercentAccuracy:    '+ str(percentAccuracy))
-    
-    meanVoltage = calculateMeanVoltage(logData)
-    print('meanVoltage:    '+ str(meanVoltage))
-    
-    meanCurrent = calculateMeanCurrent(logData)
-    print('meanCurrent:    '+ str(meanCurrent))
-    
-    meanPower = calculateMeanPower(logData)
-    print('meanPower:    '+ str(meanPower))
+    parser = argparse.ArgumentParser(description="Performance metrics over one or more session logs (.csv / .npz)")
+    parser.add_argument('logs', nargs='+', help="Session log files or glob patterns, e.g. 'logs/*.csv'")
+    parser.add_argument('-c', '--chunk_size', type=int, default=4096, help="Rows read per chunk")
+    parser.add_argument('-j', '--processes', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('-p', '--percentiles', type=float, nargs='*', default=[90, 95, 99],
+                        help="Time percentiles to report")
+    args = parser.parse_args()
+
+    file_paths = expandPaths(args.logs)
+    metrics = aggregateSessions(file_paths, args.chunk_size, args.processes)
+    printReport(metrics, args.percentiles)
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        main()
-    else:
-        print("Wrong argument format")
+    main()
@@ -7,7 +7,7 @@ class server_auth:
     def __init__(self):
         super(server_auth, self).__init__()
 
-    def decryptText(self, cipherText, Key):
+    def decryptPlainText(self, cipherText, Key):
         decodedMSG = base64.b64decode(cipherText)
         #print(decodedMSG)
         iv = decodedMSG[:16]
@@ -15,10 +15,24 @@ class server_auth:
         secret_key = bytes(str(Key), encoding = "utf8")
 #       secret_key = base64.b64decode(Key)
         cipher = AES.new(secret_key,AES.MODE_CBC,iv)
-        decryptedText = cipher.decrypt(decodedMSG[16:]).strip()
-        decryptedTextStr = decryptedText.decode('utf8')
-        decryptedTextStr1 = decryptedTextStr[decryptedTextStr.find('#'):] 
-        decryptedTextFinal = bytes(decryptedTextStr1[1:],'utf8').decode('utf8')
+        decryptedText = cipher.decrypt(decodedMSG[16:])
+        # PKCS#7 padding is removed; legacy '0' padding is left for the '|' split to discard
+        padding = decryptedText[-1] if len(decryptedText) > 0 else 0
+        if 0 < padding <= 16 and decryptedText[-padding:] == bytes([padding]) * padding:
+            decryptedText = decryptedText[:-padding]
+        return decryptedText.strip().decode('utf8')
+
+    def decryptText(self, cipherText, Key):
+        decryptedTextStr = self.decryptPlainText(cipherText, Key)
+        decryptedTextStr1 = decryptedTextStr[decryptedTextStr.find('#'):]
+        return self.parseResult(decryptedTextStr1[1:])
+
+    def decryptBatch(self, cipherText, Key):
+        # One payload holding several '#action|voltage|current|power|cumpower|' results
+        decryptedTextStr = self.decryptPlainText(cipherText, Key)
+        return [self.parseResult(result) for result in decryptedTextStr.split('#')[1:]]
+
+    def parseResult(self, decryptedTextFinal):
         action = decryptedTextFinal.split('|')[0]
         voltage = decryptedTextFinal.split('|')[1]
         current = decryptedTextFinal.split('|')[2]
@@ -27,6 +41,39 @@ class server_auth:
         return {'action': action, 'voltage': voltage, 'current': current, 'power': power, 'cumpower': cumpower}
 
 
+class StreamDecoder:
+    # Splits the byte stream from the Pi into messages. Framed clients open every connection with FRAMING_MARKER and
+    # end every base64 message with '\n', so a recv may hold several or partial messages. A stream starting with
+    # anything else comes from a legacy (unframed, one message per recv) client, whose recv is taken whole once it
+    # looks like a complete message; a '\n' arriving later still switches it to framed (framed clients that predate
+    # the marker). Pass framed to skip the detection.
+    FRAMING_MARKER = b'\n'  # base64 never starts with it and b64decode skips it, so older servers ignore it
 
+    def __init__(self, max_buffer=65536, framed=None):
+        self.buffer = b''
+        self.framed = framed
+        self.max_buffer = max_buffer
 
+    def feed(self, data):
+        self.buffer += data
+        if self.framed is None and self.buffer:
+            self.framed = self.buffer.startswith(self.FRAMING_MARKER)
+        if not self.framed and b'\n' in self.buffer:
+            self.framed = True
+        if self.framed:
+            messages = self.buffer.split(b'\n')
+            self.buffer = messages.pop()
+            return [message for message in messages if message.strip()]
+        if self.isCompleteMessage(self.buffer) or len(self.buffer) > self.max_buffer:
+            messages = [self.buffer]
+            self.buffer = b''
+            return messages
+        return []
 
+    @staticmethod
+    def isCompleteMessage(data):
+        try:
+            decoded = base64.b64decode(data, validate=True)
+        except ValueError:
+            return False
+        return len(decoded) >= 32 and len(decoded) % 16 == 0
@@ -0,0 +1,103 @@
+# Session log of the eval servers: rows are kept in typed column arrays and written out in batches, to CSV (same
+# layout the servers always wrote) and optionally to a .npz next to it that performanceMetrics can load directly.
+import atexit
+import csv
+import os
+import threading
+import time
+
+import numpy as np
+
+COLUMNS = ['timestamp', 'action', 'goal', 'time_delta', 'correct', 'voltage', 'current', 'power', 'cumpower']
+COLUMN_TYPES = {
+    'timestamp': np.float64,
+    'action': 'U32',
+    'goal': 'U32',
+    'time_delta': np.float64,
+    'correct': np.bool_,
+    'voltage': np.float64,
+    'current': np.float64,
+    'power': np.float64,
+    'cumpower': np.float64,
+}
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class SessionLog:
+    """Buffers log rows in column arrays; new rows are appended to the CSV (and the .npz rewritten) when flush_rows
+    rows are pending, by a background thread every flush_interval seconds, or on flush() / close(). close() also
+    runs at interpreter exit, so an interrupted server keeps its rows. Rows may be appended from several threads."""
+    def __init__(self, file_path, npz=False, capacity=256, flush_rows=64, flush_interval=5.0):
+        self.file_path = file_path
+        self.npz_path = os.path.splitext(file_path)[0] + ".npz" if npz else None
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.columns = {column: np.empty(capacity, dtype=COLUMN_TYPES[column]) for column in COLUMNS}
+        self.count = 0
+        self.flushed = 0  # Rows already in the CSV
+        self.last_flush = time.time()
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        if flush_interval is not None and flush_interval > 0:
+            threading.Thread(target=self.flush_loop, daemon=True).start()
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, action, goal, time_delta, correct, voltage, current, power, cumpower):
+        with self.lock:
+            if self.count == len(self.columns['timestamp']):
+                self.grow()
+            row = self.count
+            self.columns['timestamp'][row] = timestamp
+            self.columns['action'][row] = str(action)
+            self.columns['goal'][row] = str(goal)
+            self.columns['time_delta'][row] = time_delta
+            self.columns['correct'][row] = correct
+            self.columns['voltage'][row] = to_float(voltage)
+            self.columns['current'][row] = to_float(current)
+            self.columns['power'][row] = to_float(power)
+            self.columns['cumpower'][row] = to_float(cumpower)
+            self.count += 1
+            if self.count - self.flushed >= self.flush_rows:
+                self.flush()
+
+    def grow(self):
+        for column in COLUMNS:
+            grown = np.empty(2 * len(self.columns[column]), dtype=self.columns[column].dtype)
+            grown[:self.count] = self.columns[column][:self.count]
+            self.columns[column] = grown
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.time()
+            if self.count == self.flushed:
+                return
+            is_new = not os.path.isfile(self.file_path)
+            with open(self.file_path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(COLUMNS)
+                pending = [self.columns[column][self.flushed:self.count].tolist() for column in COLUMNS]
+                writer.writerows(zip(*pending))
+            self.flushed = self.count
+            if self.npz_path is not None:
+                temporary_path = self.npz_path + ".tmp.npz"
+                np.savez(temporary_path, **{column: self.columns[column][:self.count] for column in COLUMNS})
+                os.replace(temporary_path, self.npz_path)
+
+    def flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+
@@ -0,0 +1,62 @@
+"""Per-message cost of result encryption (Pi side) and decryption (eval server side).
+
+Usage (from rpi_scripts/): python benchmark_crypto.py [-n 20000] [-k 0123456789abcdef]
+"""
+import argparse
+import base64
+import os
+import sys
+import timeit
+
+from Crypto.Cipher import AES
+
+from rpi_client import EncryptionSession, format_results
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "eval_scripts"))
+from server_auth import server_auth
+
+
+def new_cipher_encrypt(message, key):
+    """What encode_encrypt_message used to do: a new IV source and cipher object per message"""
+    padded_msg = (message + "0" * (16 - (len(message) % 16))).encode()
+    iv = os.urandom(AES.block_size)
+    return base64.b64encode(iv + AES.new(key.encode(), AES.MODE_CBC, iv).encrypt(padded_msg))
+
+
+def new_cipher_decrypt(cipher_text, key):
+    """What server_auth.decryptText used to do before parsing: a new cipher object per message"""
+    decoded = base64.b64decode(cipher_text)
+    return AES.new(key.encode(), AES.MODE_CBC, decoded[:16]).decrypt(decoded[16:])
+
+
+def time_per_call(function, count):
+    return timeit.timeit(function, number=count) / count * 1e6  # us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=20000, help="Calls per measurement")
+    parser.add_argument('-k', '--key', default="0123456789abcdef", help="16 / 24 / 32 character key")
+    args = parser.parse_args()
+
+    message = format_results("runningman", 5.02, 1.37, 6.8774, 0.1234)
+    batch = [message] * 8
+    legacy_session = EncryptionSession(args.key)
+    pkcs7_session = EncryptionSession(args.key, legacy_padding=False)
+    auth = server_auth()
+    cipher_text = legacy_session.encrypt(message)
+    batch_cipher_text = legacy_session.encrypt_batch(batch)
+
+    print("Pi side (encrypt one result):")
+    print("    new cipher per message:    ", round(time_per_call(lambda: new_cipher_encrypt(message, args.key), args.count), 2), "us")
+    print("    EncryptionSession (legacy):", round(time_per_call(lambda: legacy_session.encrypt(message), args.count), 2), "us")
+    print("    EncryptionSession (PKCS#7):", round(time_per_call(lambda: pkcs7_session.encrypt(message), args.count), 2), "us")
+    print("    encrypt_batch, per result: ", round(time_per_call(lambda: legacy_session.encrypt_batch(batch), args.count) / len(batch), 2), "us")
+    print("Server side (decrypt one result):")
+    print("    new cipher per message:    ", round(time_per_call(lambda: new_cipher_decrypt(cipher_text, args.key), args.count), 2), "us")
+    print("    server_auth.decryptText:   ", round(time_per_call(lambda: auth.decryptText(cipher_text, args.key), args.count), 2), "us")
+    print("    decryptBatch, per result:  ", round(time_per_call(lambda: auth.decryptBatch(batch_cipher_text, args.key), args.count) / len(batch), 2), "us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Model comparison suite, meant to be run on the Pi: every model artifact is loaded in a fresh process and measured
+for load time (of the flat .drm where there is one), resident memory, single frame RpiMLClient.classify latency,
+batch throughput and accuracy on frames of held-out recording sessions, next to the sklearn predict +
+predict_proba latency the compiled path replaces.
+
+Usage (from rpi_scripts/): python benchmark_inference.py [trained_models/*.sav ...] [-n 500] [-a 0.8]
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from dataset import load_labelled_frames
+
+
+def resident_memory_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # Peak, where /proc is missing
+
+
+def held_out_frames(source, holdout, count, seed=0):
+    """Frames and labels of a random holdout fraction of the recording sessions, at most count frames"""
+    frames, labels, sessions = load_labelled_frames(source)
+    random_state = numpy.random.RandomState(seed)
+    session_ids = numpy.unique(sessions)
+    chosen = random_state.choice(session_ids, max(1, int(round(len(session_ids) * holdout))), replace=False)
+    rows = numpy.flatnonzero(numpy.isin(sessions, chosen))
+    rows = numpy.sort(random_state.choice(rows, min(count, len(rows)), replace=False))
+    return numpy.array(frames[rows]), numpy.array(labels[rows])
+
+
+def percentiles(timings):
+    timings = numpy.array(timings) * 1000.0  # ms
+    return {'p50_ms': float(numpy.percentile(timings, 50)), 'p95_ms': float(numpy.percentile(timings, 95)),
+            'p99_ms': float(numpy.percentile(timings, 99)), 'mean_ms': float(numpy.mean(timings))}
+
+
+def benchmark_model(file_path, frames, labels, batch_size):
+    """Runs in its own process so load time and memory are not flattered by earlier models"""
+    from rpi_client import RpiMLClient
+    memory_before = resident_memory_mb()
+    start_time = time.perf_counter()
+    ml_client = RpiMLClient(file_path)
+    load_seconds = time.perf_counter() - start_time
+    memory_mb = resident_memory_mb() - memory_before
+
+    ml_client.classify(frames[0])  # Warm up
+    classify_timings = []
+    predicted = []
+    for frame in frames:
+        start_time = time.perf_counter()
+        predicted.append(ml_client.classify(frame))
+        classify_timings.append(time.perf_counter() - start_time)
+    expected = [ml_client.action_name(label) for label in labels]
+
+    model = ml_client.model  # None for a flat model file without its .sav
+    sklearn_timings = [numpy.nan]
+    throughput = numpy.nan
+    if model is not None:
+        features = ml_client.feature_bank(frames)
+        sklearn_timings = []
+        for row in features[:200]:
+            start_time = time.perf_counter()
+            model.predict(row.reshape(1, -1))
+            model.predict_proba(row.reshape(1, -1))
+            sklearn_timings.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        for start in range(0, len(frames), batch_size):
+            model.predict(ml_client.feature_bank(frames[start:start + batch_size]))
+        throughput = len(frames) / (time.perf_counter() - start_time)
+
+    return {
+        'load_seconds': load_seconds,
+        'memory_mb': memory_mb,
+        'compiled_path': type(ml_client.compiled_model).__name__,
+        'classify': percentiles(classify_timings),
+        'sklearn': percentiles(sklearn_timings),
+        'throughput': throughput,  # Frames per second, batched features + sklearn predict
+        'accuracy': float(numpy.mean([a == b for a, b in zip(predicted, expected)])),
+    }
+
+
+def training_accuracy(file_path):
+    """Cross validation accuracy from the metadata train.py writes next to an artifact, if there is one"""
+    try:
+        with open(os.path.splitext(file_path)[0] + ".json") as f:
+            return json.load(f).get('cv_accuracy_mean')
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('models', nargs='*', help="Model files to benchmark (default: all of trained_models/)")
+    parser.add_argument('-d', '--data', default="training_data/*.npy",
+                        help="Glob of training data chunks, or a dataset.py store directory")
+    parser.add_argument('-n', '--rows', type=int, default=500, help="Number of held-out frames to time")
+    parser.add_argument('-H', '--holdout', type=float, default=0.2, help="Fraction of sessions to draw frames from")
+    parser.add_argument('-b', '--batch_size', type=int, default=256, help="Frames per batch for throughput")
+    parser.add_argument('-a', '--min_accuracy', type=float, default=None,
+                        help="Accuracy bar; the fastest model meeting it is recommended")
+    args = parser.parse_args()
+
+    model_paths = args.models
+    if not model_paths:
+        model_paths = sorted(glob.glob("trained_models/*.sav") + glob.glob("trained_models/*.joblib")
+                             + glob.glob("trained_models/*/*.sav"))
+        # Flat models are picked up by RpiMLClient through their .sav; only lone ones are listed separately
+        model_paths += sorted(file_path for file_path in glob.glob("trained_models/*.drm")
+                              if not os.path.isfile(os.path.splitext(file_path)[0] + ".sav"))
+    frames, labels = held_out_frames(args.data, args.holdout, args.rows)
+    print("Benchmarking", len(model_paths), "models on", len(frames), "held-out frames\n")
+
+    results = {}
+    for file_path in model_paths:
+        with ProcessPoolExecutor(1) as pool:
+            try:
+                results[file_path] = pool.submit(benchmark_model, file_path, frames, labels, args.batch_size).result()
+            except Exception as e:
+                print(file_path, "could not be benchmarked:", repr(e))
+
+    header = "{:<44} {:>7} {:>8} {:>9} {:>9} {:>9} {:>10} {:>10} {:>8} {:>8}".format(
+        "model", "load s", "mem MB", "p50 ms", "p95 ms", "p99 ms", "sk p50 ms", "frames/s", "acc", "cv acc")
+    print(header)
+    print("-" * len(header))
+    cv_accuracies = {file_path: training_accuracy(file_path) for file_path in results}
+    for file_path, result in sorted(results.items(), key=lambda item: item[1]['classify']['p50_ms']):
+        cv_accuracy = cv_accuracies[file_path]
+        print("{:<44} {:>7.3f} {:>8.1f} {:>9.4f} {:>9.4f} {:>9.4f} {:>10.4f} {:>10.0f} {:>8.3f} {:>8}".format(
+            os.path.relpath(file_path)[-44:], result['load_seconds'], result['memory_mb'],
+            result['classify']['p50_ms'], result['classify']['p95_ms'], result['classify']['p99_ms'],
+            result['sklearn']['p50_ms'], result['throughput'], result['accuracy'],
+            "-" if cv_accuracy is None else "{:.3f}".format(cv_accuracy)))
+    print("\nacc is measured on the held-out frames; models trained on all of training_data have seen them, so "
+          "cv acc (from train.py metadata) is the fairer number where present.")
+
+    if args.min_accuracy is not None:
+        # cv acc where train.py recorded one (0.0 included), the held-out accuracy otherwise
+        eligible = [(result['classify']['p50_ms'], file_path) for file_path, result in results.items()
+                    if (result['accuracy'] if cv_accuracies[file_path] is None else cv_accuracies[file_path])
+                    >= args.min_accuracy]
+        if eligible:
+            print("Fastest model with accuracy >= {}: {}".format(args.min_accuracy, min(eligible)[1]))
+        else:
+            print("No model reaches accuracy", args.min_accuracy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Consolidated training dataset: every training_data/*.npy chunk merged into one memory-mapped frame array.
+
+The store is a directory holding frames.npy, shape (n_frames, frame_length, n_channels), and index.npz with one
+label / session / params entry per frame plus the session and parameter tables. Frames are ordered by move, then
+session, so every move and every session is one contiguous range and is returned as a view of the mmap.
+
+Usage (from rpi_scripts/):
+    python dataset.py compact [-d "training_data/*.npy"] [-o training_data/consolidated]
+    python dataset.py info [-o training_data/consolidated]
+"""
+import argparse
+import glob
+import os
+import re
+
+import numpy
+
+from rpi_client import Move
+
+DEFAULT_STORE = "training_data/consolidated"
+# <session>_<MOVE>L<frame length>SI<sampling interval>R<overlap ratio>(<part>[_incomplete]).npy
+CHUNK_NAME = re.compile(r'^(?P<session>.+)_(?P<move>[A-Z]+)L(?P<frame_length>\d+)SI(?P<sampling_interval>[\d.]+)'
+                        r'R(?P<overlap>[\d.]+)\((?P<part>\d+)(?P<incomplete>_incomplete)?\)\.npy$')
+
+
+def parse_chunk_name(file_name):
+    """Returns the fields encoded in a training chunk's file name, or None if it does not follow the scheme"""
+    match = CHUNK_NAME.match(os.path.basename(file_name))
+    if match is None or match.group('move') not in Move.__members__:
+        return None
+    return {
+        'session': match.group('session'),
+        'move': match.group('move'),
+        'label': Move[match.group('move')].value,
+        'frame_length': int(match.group('frame_length')),
+        'sampling_interval': float(match.group('sampling_interval')),
+        'overlap': float(match.group('overlap')),
+        'part': int(match.group('part')),
+        'incomplete': match.group('incomplete') is not None,
+    }
+
+
+def compact(pattern="training_data/*.npy", store=DEFAULT_STORE):
+    """Merges the chunks matching pattern into a store; returns the number of frames written"""
+    chunks = []
+    for file_name in glob.glob(pattern):
+        info = parse_chunk_name(file_name)
+        if info is None:
+            print("Skipping", file_name, "(name does not follow the chunk scheme)")
+            continue
+        frames = numpy.load(file_name, mmap_mode='r')
+        if frames.ndim != 3 or len(frames) == 0:
+            print("Skipping", file_name, "(no frames)")
+            continue
+        chunks.append((file_name, info, frames.shape))
+    if not chunks:
+        raise ValueError("No training chunks match " + pattern)
+    frame_shape = chunks[0][2][1:]
+    mismatched = [file_name for file_name, _, shape in chunks if shape[1:] != frame_shape]
+    if mismatched:
+        raise ValueError("Chunks have different frame shapes, compact them separately: " + ", ".join(mismatched))
+
+    # Move, then session, then part order makes moves and sessions contiguous
+    chunks.sort(key=lambda chunk: (chunk[1]['label'], chunk[1]['session'], chunk[1]['part']))
+    sessions = []
+    session_ids = {}
+    params = []
+    param_ids = {}
+    n_frames = sum(shape[0] for _, _, shape in chunks)
+    labels = numpy.empty(n_frames, dtype=numpy.int16)
+    session_column = numpy.empty(n_frames, dtype=numpy.int32)
+    param_column = numpy.empty(n_frames, dtype=numpy.int16)
+
+    os.makedirs(store, exist_ok=True)
+    frames_out = numpy.lib.format.open_memmap(os.path.join(store, "frames.npy"), mode='w+', dtype=numpy.float64,
+                                              shape=(n_frames,) + frame_shape)
+    position = 0
+    for file_name, info, shape in chunks:
+        session_key = (info['session'], info['move'])
+        if session_key not in session_ids:
+            session_ids[session_key] = len(sessions)
+            sessions.append(info['session'] + "_" + info['move'])
+        param_key = (info['frame_length'], info['sampling_interval'], info['overlap'])
+        if param_key not in param_ids:
+            param_ids[param_key] = len(params)
+            params.append(param_key)
+        end = position + shape[0]
+        frames_out[position:end] = numpy.load(file_name)
+        labels[position:end] = info['label']
+        session_column[position:end] = session_ids[session_key]
+        param_column[position:end] = param_ids[param_key]
+        position = end
+    frames_out.flush()
+    del frames_out
+    numpy.savez(os.path.join(store, "index.npz"), labels=labels, sessions=session_column, params=param_column,
+                session_names=numpy.array(sessions), param_table=numpy.array(params, dtype=numpy.float64))
+    return n_frames
+
+
+class TrainingDataset:
+    """Read-only view of a compacted store; frames stay on disk and are paged in on access"""
+    def __init__(self, store=DEFAULT_STORE):
+        self.store = store
+        self.frames = numpy.load(os.path.join(store, "frames.npy"), mmap_mode='r')
+        with numpy.load(os.path.join(store, "index.npz")) as index:
+            self.labels = index['labels']
+            self.sessions = index['sessions']
+            self.params = index['params']
+            self.session_names = [str(name) for name in index['session_names']]
+            self.param_table = index['param_table']  # Rows of frame_length, sampling_interval, overlap
+
+    def __len__(self):
+        return len(self.frames)
+
+    def range_of(self, column, value):
+        # Rows are sorted by label then session, so matching rows are contiguous
+        rows = numpy.flatnonzero(column == value)
+        if len(rows) == 0:
+            return 0, 0
+        return int(rows[0]), int(rows[-1]) + 1
+
+    def move(self, move):
+        """Frames of one move (a Move, its name or its label) as a zero-copy view"""
+        label = Move[move].value if isinstance(move, str) else int(getattr(move, 'value', move))
+        start, end = self.range_of(self.labels, label)
+        return self.frames[start:end]
+
+    def session(self, session):
+        """Frames of one recording session (its name as in session_names, or its index) as a zero-copy view"""
+        session_id = self.session_names.index(session) if isinstance(session, str) else session
+        start, end = self.range_of(self.sessions, session_id)
+        return self.frames[start:end]
+
+    def session_params(self, session):
+        """frame_length, sampling_interval and overlap ratio a session was recorded with"""
+        session_id = self.session_names.index(session) if isinstance(session, str) else session
+        start, _ = self.range_of(self.sessions, session_id)
+        frame_length, sampling_interval, overlap = self.param_table[self.params[start]]
+        return int(frame_length), float(sampling_interval), float(overlap)
+
+    def session_move(self, session):
+        session_id = self.session_names.index(session) if isinstance(session, str) else session
+        start, _ = self.range_of(self.sessions, session_id)
+        return Move(int(self.labels[start])).name
+
+    def iter_batches(self, batch_size=1024):
+        """Yields (frames, labels) in order, batch_size frames at a time, as views of the mmap"""
+        for start in range(0, len(self.frames), batch_size):
+            yield self.frames[start:start + batch_size], self.labels[start:start + batch_size]
+
+
+def load_frames(source):
+    """All frames of a store directory (memory-mapped) or of the chunks matching a glob (loaded and concatenated)"""
+    if os.path.isdir(source):
+        return TrainingDataset(source).frames
+    return numpy.concatenate([numpy.load(file_name) for file_name in sorted(glob.glob(source))])
+
+
+def load_labelled_frames(source):
+    """Frames, their labels and their session indices, from a store directory or from the chunks matching a glob"""
+    if os.path.isdir(source):
+        dataset = TrainingDataset(source)
+        return dataset.frames, dataset.labels, dataset.sessions
+    frames, labels, sessions, session_ids = [], [], [], {}
+    for file_name in sorted(glob.glob(source)):
+        info = parse_chunk_name(file_name)
+        if info is None:
+            continue
+        chunk = numpy.load(file_name)
+        session_id = session_ids.setdefault((info['session'], info['move']), len(session_ids))
+        frames.append(chunk)
+        labels.append(numpy.full(len(chunk), info['label'], dtype=numpy.int16))
+        sessions.append(numpy.full(len(chunk), session_id, dtype=numpy.int32))
+    return numpy.concatenate(frames), numpy.concatenate(labels), numpy.concatenate(sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacts training_data chunks into one memory-mapped store")
+    parser.add_argument('command', choices=['compact', 'info'])
+    parser.add_argument('-d', '--data', default="training_data/*.npy", help="Glob of training data chunks")
+    parser.add_argument('-o', '--store', default=DEFAULT_STORE, help="Store directory")
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        print("Frames written:", compact(args.data, args.store))
+    dataset = TrainingDataset(args.store)
+    print("Frames:", len(dataset), "shape", dataset.frames.shape[1:], "sessions:", len(dataset.session_names))
+    for label in numpy.unique(dataset.labels):
+        print("    {:<12} {:>6} frames".format(Move(int(label)).name, len(dataset.move(int(label)))))
+
+
+if __name__ == '__main__':
+    main()
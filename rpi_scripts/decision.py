@@ -0,0 +1,101 @@
+"""Move decision engines: fed one class-probability vector per frame, they decide when a move has been seen"""
+from lazy_import import lazy_module
+
+numpy = lazy_module("numpy", globals())
+
+
+class ConsecutiveMatchDecision:
+    """Accepts a move once the most likely class of 2 consecutive frames matches (the original behaviour)"""
+    def __init__(self, matches=2):
+        self.matches = matches
+        self.candidates = []
+
+    def reset(self):
+        self.candidates = []
+
+    def update(self, probabilities):
+        """Returns the index of the decided class, or None if more frames are needed"""
+        self.candidates.append(int(numpy.argmax(probabilities)))
+        self.candidates = self.candidates[-self.matches:]
+        if len(self.candidates) == self.matches and len(set(self.candidates)) == 1:
+            return self.candidates[0]
+        return None
+
+
+class MovingAverageDecision:
+    """Exponential moving average of the probability vectors; decides once the leading class reaches threshold.
+
+    A clear move is decided on its first frame, an ambiguous one waits for more frames, up to max_frames after
+    which the leading class is taken regardless.
+    """
+    def __init__(self, threshold=0.7, alpha=0.5, max_frames=6):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.max_frames = max_frames
+        self.average = None
+        self.frames = 0
+
+    def reset(self):
+        self.average = None
+        self.frames = 0
+
+    def update(self, probabilities):
+        probabilities = numpy.asarray(probabilities, dtype=numpy.float64)
+        self.frames += 1
+        if self.average is None:
+            self.average = probabilities.copy()
+        else:
+            self.average += self.alpha * (probabilities - self.average)
+        leader = int(numpy.argmax(self.average))
+        if self.average[leader] >= self.threshold or self.frames >= self.max_frames:
+            return leader
+        return None
+
+
+class SequentialRatioDecision:
+    """Sequential probability ratio test between the two most likely classes.
+
+    Log probabilities are summed over frames; the move is decided once the leader beats the runner-up by a
+    likelihood ratio of threshold / (1 - threshold), or after max_frames.
+    """
+    def __init__(self, threshold=0.95, max_frames=6, floor=1e-3):
+        self.log_bound = numpy.log(threshold / (1.0 - threshold))
+        self.max_frames = max_frames
+        self.floor = floor  # Keeps a single zero probability from vetoing a class forever
+        self.log_likelihood = None
+        self.frames = 0
+
+    def reset(self):
+        self.log_likelihood = None
+        self.frames = 0
+
+    def update(self, probabilities):
+        log_probabilities = numpy.log(numpy.maximum(numpy.asarray(probabilities, dtype=numpy.float64), self.floor))
+        self.frames += 1
+        self.log_likelihood = log_probabilities if self.log_likelihood is None \
+            else self.log_likelihood + log_probabilities
+        if len(self.log_likelihood) < 2:
+            return 0
+        runner_up, leader = numpy.argsort(self.log_likelihood)[-2:]
+        if self.log_likelihood[leader] - self.log_likelihood[runner_up] >= self.log_bound \
+                or self.frames >= self.max_frames:
+            return int(leader)
+        return None
+
+
+DECISION_ENGINES = {
+    'consecutive': ConsecutiveMatchDecision,
+    'ema': MovingAverageDecision,
+    'sprt': SequentialRatioDecision,
+}
+
+
+def make_decision_engine(name, threshold=None, max_frames=None):
+    """Builds a decision engine by name, overriding its threshold / max_frames where given and applicable"""
+    options = {}
+    if name != 'consecutive':
+        if threshold is not None:
+            options['threshold'] = threshold
+        if max_frames is not None:
+            options['max_frames'] = max_frames
+    return DECISION_ENGINES[name](**options)
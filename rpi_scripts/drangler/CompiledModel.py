@@ -0,0 +1,188 @@
+import json
+import struct
+
+import numpy as np
+
+
+def compile_model(model):
+    """Flattens a fitted sklearn classifier into plain numpy arrays for single-row inference.
+
+    Random forests / decision trees and KNN classifiers are compiled; anything else is wrapped so that it still
+    answers label and probabilities from one predict_proba call.
+    """
+    if hasattr(model, "estimators_") and all(hasattr(tree, "tree_") for tree in model.estimators_):
+        return CompiledForest([tree.tree_ for tree in model.estimators_], model.classes_)
+    elif hasattr(model, "tree_"):
+        return CompiledForest([model.tree_], model.classes_)
+    elif hasattr(model, "_fit_X") and hasattr(model, "n_neighbors"):
+        return CompiledKNN(model)
+    return SklearnModel(model)
+
+
+class CompiledForest:
+    """Every tree packed into shared node arrays, walked for all trees at once, one level per step"""
+    def __init__(self, trees, classes):
+        self.classes = np.asarray(classes)
+        self.n_trees = len(trees)
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        self.roots = offsets[:-1].astype(np.intp)
+        self.max_depth = max(tree.max_depth for tree in trees)
+
+        left, right, feature, threshold, value = [], [], [], [], []
+        for offset, tree in zip(offsets, trees):
+            nodes = np.arange(tree.node_count) + offset
+            is_leaf = tree.children_left == -1
+            # Leaves point at themselves so finished trees stay put while deeper ones keep walking
+            left.append(np.where(is_leaf, nodes, tree.children_left + offset))
+            right.append(np.where(is_leaf, nodes, tree.children_right + offset))
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            tree_value = tree.value[:, 0, :]
+            normalizer = tree_value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            value.append(tree_value / normalizer)
+
+        self.left = np.concatenate(left).astype(np.intp)
+        self.right = np.concatenate(right).astype(np.intp)
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold)
+        self.value = np.concatenate(value)
+
+    def predict(self, feature_row):
+        """Returns (label, class probabilities) for a single feature row"""
+        row = np.asarray(feature_row, dtype=np.float32).reshape(-1)  # sklearn trees split on float32 inputs
+        nodes = self.roots
+        for _ in range(self.max_depth):
+            go_left = row[self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        probabilities = self.value[nodes].sum(axis=0) / self.n_trees
+        return self.classes[np.argmax(probabilities)], probabilities
+
+
+class CompiledKNN:
+    """Reference samples packed into one matrix with precomputed squared norms"""
+    def __init__(self, model):
+        metric = model.effective_metric_
+        p = model.effective_metric_params_.get("p", getattr(model, "p", 2))
+        if metric == "euclidean" or (metric == "minkowski" and p == 2):
+            self.p = 2
+        elif metric == "manhattan" or (metric == "minkowski" and p == 1):
+            self.p = 1
+        else:
+            raise ValueError("unsupported KNN metric: " + str(metric))
+        if model.weights not in ("uniform", "distance"):
+            raise ValueError("unsupported KNN weights: " + str(model.weights))
+
+        self.classes = np.asarray(model.classes_)
+        self.reference = np.ascontiguousarray(model._fit_X, dtype=np.float64)
+        self.reference_norms = np.einsum("ij,ij->i", self.reference, self.reference)
+        self.reference_labels = np.asarray(model._y, dtype=np.intp)
+        self.n_neighbors = model.n_neighbors
+        self.weights = model.weights
+
+    def predict(self, feature_row):
+        """Returns (label, class probabilities) for a single feature row"""
+        row = np.asarray(feature_row, dtype=np.float64).reshape(-1)
+        if self.p == 2:
+            distances = self.reference_norms - 2.0 * self.reference.dot(row) + row.dot(row)
+            np.maximum(distances, 0.0, out=distances)
+        else:
+            distances = np.absolute(self.reference - row).sum(axis=1)
+        neighbours = np.argpartition(distances, self.n_neighbors - 1)[:self.n_neighbors]
+
+        if self.weights == "uniform":
+            weights = np.ones(self.n_neighbors)
+        else:
+            neighbour_distances = np.sqrt(distances[neighbours]) if self.p == 2 else distances[neighbours]
+            exact = neighbour_distances == 0.0
+            weights = exact.astype(np.float64) if exact.any() else 1.0 / neighbour_distances
+        probabilities = np.bincount(self.reference_labels[neighbours], weights=weights, minlength=len(self.classes))
+        probabilities /= probabilities.sum()
+        return self.classes[np.argmax(probabilities)], probabilities
+
+
+class SklearnModel:
+    """Fallback for models that cannot be compiled; one predict_proba call yields both label and probabilities"""
+    def __init__(self, model):
+        self.model = model
+        self.classes = np.asarray(model.classes_)
+
+    def predict(self, feature_row):
+        probabilities = self.model.predict_proba(np.asarray(feature_row).reshape(1, -1))[0]
+        return self.classes[np.argmax(probabilities)], probabilities
+
+
+# Flat model file: MODEL_MAGIC, uint32 format version, uint32 header length, JSON header, then every array 64 byte
+# aligned. The header names the compiled class, its scalar settings and each array's dtype, shape and offset, so a
+# load is one mmap and no unpickling; array pages are read from disk (and shared between processes) on first use.
+MODEL_MAGIC = b"DRANGLER"
+MODEL_FORMAT_VERSION = 1
+ARRAY_ALIGNMENT = 64
+
+
+def save_compiled(compiled_model, file_path):
+    """Writes a CompiledForest or CompiledKNN to file_path in the flat model format"""
+    if isinstance(compiled_model, CompiledForest):
+        settings = {"n_trees": compiled_model.n_trees, "max_depth": int(compiled_model.max_depth)}
+        names = ["classes", "roots", "left", "right", "feature", "threshold", "value"]
+    elif isinstance(compiled_model, CompiledKNN):
+        settings = {"p": compiled_model.p, "n_neighbors": int(compiled_model.n_neighbors),
+                    "weights": compiled_model.weights}
+        names = ["classes", "reference", "reference_norms", "reference_labels"]
+    else:
+        raise ValueError("only compiled forests and KNN classifiers can be saved, not " + type(compiled_model).__name__)
+
+    arrays = {name: np.ascontiguousarray(getattr(compiled_model, name)) for name in names}
+    # Offsets are relative to the end of the header, whose length depends on them
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+    header = json.dumps({"kind": type(compiled_model).__name__, "settings": settings, "arrays": layout}).encode()
+    data_start = -(-(len(MODEL_MAGIC) + 8 + len(header)) // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    with open(file_path, "wb") as f:
+        f.write(MODEL_MAGIC + struct.pack("<II", MODEL_FORMAT_VERSION, len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+
+def is_compiled_file(file_path):
+    with open(file_path, "rb") as f:
+        return f.read(len(MODEL_MAGIC)) == MODEL_MAGIC
+
+
+def load_compiled(file_path):
+    """Maps a flat model file written by save_compiled; returns a CompiledForest or CompiledKNN backed by the mmap"""
+    data = np.memmap(file_path, dtype=np.uint8, mode="r")
+    if bytes(data[:len(MODEL_MAGIC)]) != MODEL_MAGIC:
+        raise ValueError(file_path + " is not a flat model file")
+    version, header_length = struct.unpack("<II", bytes(data[len(MODEL_MAGIC):len(MODEL_MAGIC) + 8]))
+    if version != MODEL_FORMAT_VERSION:
+        raise ValueError(file_path + " has model format version " + str(version) + ", expected "
+                         + str(MODEL_FORMAT_VERSION))
+    header_start = len(MODEL_MAGIC) + 8
+    header = json.loads(bytes(data[header_start:header_start + header_length]).decode())
+    data_start = -(-(header_start + header_length) // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    arrays = {}
+    for name, layout in header["arrays"].items():
+        dtype = np.dtype(layout["dtype"])
+        count = int(np.prod(layout["shape"], dtype=np.int64))
+        start = data_start + layout["offset"]
+        arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(layout["shape"])
+
+    kinds = {"CompiledForest": CompiledForest, "CompiledKNN": CompiledKNN}
+    if header["kind"] not in kinds:
+        raise ValueError(file_path + " holds an unknown model kind: " + header["kind"])
+    compiled_model = kinds[header["kind"]].__new__(kinds[header["kind"]])
+    compiled_model.__dict__.update(header["settings"])
+    for name, array in arrays.items():
+        # Index arrays are written as the exporting machine's intp; only a 32 / 64 bit mismatch costs a copy
+        if name in ("roots", "left", "right", "feature", "reference_labels"):
+            array = array.astype(np.intp, copy=False)
+        setattr(compiled_model, name, array)
+    return compiled_model
@@ -0,0 +1,142 @@
+import hashlib
+import inspect
+import os
+import sys
+
+import numpy as np
+import scipy
+
+from drangler import FeatureExtractor
+
+DEFAULT_CACHE_DIR = "training_data/.feature_cache"
+
+
+def source_version(extractor=FeatureExtractor.extract_batch):
+    """Changes whenever the extractor's module source (get_features, extract_batch, FeatureBank, ...) or the numpy /
+    scipy versions change, which invalidates every cached matrix"""
+    module = sys.modules[extractor.__module__]
+    digest = hashlib.sha1(inspect.getsource(module).encode())
+    digest.update((np.__version__ + scipy.__version__).encode())
+    return digest.hexdigest()[:16]
+
+
+def extractor_fingerprint(extractor=FeatureExtractor.extract_batch):
+    """Version of the feature set: <source version>-<hash of the function name, or of the groups of a FeatureBank>"""
+    name = getattr(extractor, '__qualname__', repr(extractor))
+    return source_version(extractor) + "-" + hashlib.sha1(name.encode()).hexdigest()[:8]
+
+
+def content_key(frames):
+    frames = np.ascontiguousarray(frames)
+    digest = hashlib.sha1(str((frames.shape, frames.dtype.str)).encode())
+    digest.update(memoryview(frames).cast('B'))
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """On-disk cache of extracted feature matrices, keyed by a hash of the frames and the extractor fingerprint.
+
+    Entries are <content hash>_<fingerprint>.npy files; reading an entry refreshes its mtime and the least recently
+    used entries are removed once the cache grows past max_bytes. Entries of other extractors (other FeatureBank
+    groups) of the same source version are kept, so alternating feature sets do not evict each other. With sweep set,
+    entries of other source versions, and temporary files left by writers that have died, are removed when the cache
+    is opened; when several processes share the directory, let one of them sweep before the others open it. Every
+    file operation tolerates entries another process has just removed, and a corrupt entry is recomputed.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 * 1024,
+                 extractor=FeatureExtractor.extract_batch, sweep=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extractor = extractor
+        self.fingerprint = extractor_fingerprint(extractor)
+        self.version = source_version(extractor)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        if sweep:
+            for file_name, _, _ in self.entries():
+                if "_" + self.version + "-" not in os.path.basename(file_name):
+                    remove(file_name)
+            for file_name in self.orphaned_temporary_files():
+                remove(file_name)
+
+    def entries(self):
+        """(path, size, mtime) of every cache entry"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def orphaned_temporary_files(self):
+        """<entry>.<pid>.tmp files whose writing process no longer exists"""
+        orphans = []
+        for name in os.listdir(self.cache_dir):
+            parts = name.split(".")
+            if len(parts) >= 3 and parts[-1] == "tmp" and parts[-2].isdigit() and not process_exists(int(parts[-2])):
+                orphans.append(os.path.join(self.cache_dir, name))
+        return orphans
+
+    def path_of(self, frames):
+        return os.path.join(self.cache_dir, content_key(frames) + "_" + self.fingerprint + ".npy")
+
+    def features(self, frames):
+        """extractor(frames), from the cache when these frames were extracted before"""
+        path = self.path_of(frames)
+        try:
+            os.utime(path)
+            features = np.load(path)
+            self.hits += 1
+            return features
+        except FileNotFoundError:
+            pass
+        except (ValueError, EOFError, OSError):  # Truncated or corrupt entry
+            remove(path)
+        self.misses += 1
+        features = self.extractor(frames)
+        temporary_path = path + ".%d.tmp" % os.getpid()  # Processes missing on the same frames write apart
+        with open(temporary_path, 'wb') as f:
+            np.save(f, features)
+        os.replace(temporary_path, path)
+        self.evict()
+        return features
+
+    def features_for_file(self, file_name):
+        return self.features(np.load(file_name))
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            remove(path)
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            remove(path)
+        for path in self.orphaned_temporary_files():
+            remove(path)
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, owned by another user
+    return True
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # Already removed by another process sharing the cache
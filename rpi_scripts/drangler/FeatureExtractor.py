@@ -1,23 +1,48 @@
+import time
+
 import numpy as np
 from scipy.stats import iqr
 
+# Number of statistics computed per signal, in the order returned by get_features
+FEATURES_PER_SIGNAL = 8
 
-def extract(frame_collection):
-    data_collection = []
-    for frame in frame_collection:
-        data = []
-        for signal in frame:
-            data = np.append(data, get_features(signal))
 
-        data_collection.append(np.array(data))
-    return np.array(data_collection)
+def extract(frame_collection):
+    # Each row of a frame is treated as one signal
+    frames = np.asarray(frame_collection, dtype=np.float64)
+    return extract_batch(frames.transpose(0, 2, 1))
 
 
 def get_features_from_frame(frame):
-    data = []
-    for i in range(0, frame.shape[1]):
-        data = np.append(data, get_features(frame[:, i]))
-    return data
+    return extract_batch(np.asarray(frame, dtype=np.float64)[np.newaxis])[0]
+
+
+def extract_batch(frames, out=None):
+    """Computes get_features for every channel of every frame in a (n_frames, frame_length, n_channels) array.
+
+    Returns a (n_frames, n_channels * 8) matrix laid out channel by channel, identical to calling
+    get_features_from_frame on each frame. A preallocated matrix may be passed in as out.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    n_frames, _, n_channels = frames.shape
+    if out is None:
+        out = np.empty((n_frames, n_channels * FEATURES_PER_SIGNAL))
+    features = out.reshape(n_frames, n_channels, FEATURES_PER_SIGNAL)
+
+    # Reduce over a contiguous last axis so numpy sums in the same order as it does for a single signal
+    signals = np.ascontiguousarray(frames.transpose(0, 2, 1))
+    signal_mean = np.mean(signals, axis=-1)
+    signal_var = np.var(signals, axis=-1)
+
+    features[:, :, 0] = signal_mean                                                # mean
+    features[:, :, 1] = signal_var                                                 # var
+    features[:, :, 2] = np.median(signals, axis=-1)                                # median
+    features[:, :, 3] = iqr(signals, axis=-1)                                      # iqr
+    features[:, :, 4] = np.sqrt(signal_var)                                        # std
+    features[:, :, 5] = np.max(signals, axis=-1)                                   # max
+    features[:, :, 6] = np.min(signals, axis=-1)                                   # min
+    features[:, :, 7] = np.mean(np.absolute(signals - signal_mean[..., np.newaxis]), axis=-1)  # mad
+    return out
 
 
 def get_features(signal):
@@ -33,18 +58,144 @@ def get_features(signal):
     ]
 
 
-# Time domain
-def mean(signal):
-    return np.mean(signal)
+def mad(data):
+    return np.mean(np.absolute(data - np.mean(data)))
+
 
+# Feature bank: optional feature groups computed next to the statistics of extract_batch. Readings are left
+# accel xyz, left gyro xyz, right accel xyz, right gyro xyz, so channels form sensor triads and the left hand's
+# channels pair up with the right hand's six channels later.
+BAND_COUNT = 4  # Frequency bands the non-DC rfft bins are split into
+HANDS = 2
 
-def median(signal):
-    return np.median(signal)
 
+class FrameBatch:
+    """A (n_frames, frame_length, n_channels) batch plus the intermediates feature groups share, each computed on
+    first use: channel-major signals, their means, mean-removed signals and the power spectrum of a single rfft"""
+    def __init__(self, frames):
+        self.frames = np.asarray(frames, dtype=np.float64)
+        self.n_frames, self.frame_length, self.n_channels = self.frames.shape
+        self.cache = {}
 
-def variance(signal):
-    return np.var(signal)
+    def shared(self, name, compute):
+        if name not in self.cache:
+            self.cache[name] = compute()
+        return self.cache[name]
 
+    @property
+    def signals(self):
+        return self.shared("signals", lambda: np.ascontiguousarray(self.frames.transpose(0, 2, 1)))
 
-def mad(data):
-    return np.mean(np.absolute(data - np.mean(data)))
+    @property
+    def centered(self):
+        return self.shared("centered", lambda: self.signals - np.mean(self.signals, axis=-1, keepdims=True))
+
+    @property
+    def power(self):
+        """|rfft|^2 of every mean-removed signal, DC bin dropped: (n_frames, n_channels, frame_length // 2)"""
+        return self.shared("power", lambda: np.abs(np.fft.rfft(self.centered, axis=-1)[..., 1:]) ** 2
+                           / self.frame_length)
+
+
+def band_energy(batch):
+    """Spectral energy in BAND_COUNT equal slices of the non-DC bins, per channel"""
+    bins = batch.power.shape[-1]
+    edges = np.linspace(0, bins, min(BAND_COUNT, bins) + 1).astype(int)[:-1]
+    energy = np.add.reduceat(batch.power, edges, axis=-1)
+    if energy.shape[-1] < BAND_COUNT:  # Frames too short for every band
+        energy = np.concatenate([energy, np.zeros(energy.shape[:-1] + (BAND_COUNT - energy.shape[-1],))], axis=-1)
+    return energy.reshape(batch.n_frames, -1)
+
+
+def dominant_frequency(batch):
+    """Strongest non-DC frequency per channel, in cycles per reading"""
+    return (np.argmax(batch.power, axis=-1) + 1) / batch.frame_length
+
+
+def zero_crossing(batch):
+    """Fraction of consecutive readings on opposite sides of the frame mean, per channel"""
+    signs = np.signbit(batch.centered)
+    return np.mean(signs[..., 1:] != signs[..., :-1], axis=-1)
+
+
+def signal_magnitude_area(batch):
+    """Mean of |x| + |y| + |z| over the frame, per sensor triad"""
+    triads = np.abs(batch.signals).reshape(batch.n_frames, batch.n_channels // 3, 3, batch.frame_length)
+    return np.mean(np.sum(triads, axis=2), axis=-1)
+
+
+def jerk(batch):
+    """Mean and max absolute change between consecutive readings, per channel"""
+    change = np.abs(np.diff(batch.signals, axis=-1))
+    return np.stack([np.mean(change, axis=-1), np.max(change, axis=-1)], axis=-1).reshape(batch.n_frames, -1)
+
+
+def cross_correlation(batch):
+    """Pearson correlation of each left hand channel with the same right hand channel (0 for a flat channel)"""
+    hands = batch.centered.reshape(batch.n_frames, HANDS, batch.n_channels // HANDS, batch.frame_length)
+    left, right = hands[:, 0], hands[:, 1]
+    norm = np.sqrt(np.sum(left * left, axis=-1) * np.sum(right * right, axis=-1))
+    covariance = np.sum(left * right, axis=-1)
+    return np.divide(covariance, norm, out=np.zeros_like(covariance), where=norm > 0)
+
+
+# Feature group name -> (function of a FrameBatch returning (n_frames, k), feature names per channel or group)
+FEATURE_GROUPS = {
+    "stats": (lambda batch: extract_batch(batch.frames),
+              ["mean", "var", "median", "iqr", "std", "max", "min", "mad"]),
+    "band_energy": (band_energy, ["band" + str(band) for band in range(BAND_COUNT)]),
+    "dominant_frequency": (dominant_frequency, ["dominant_frequency"]),
+    "zero_crossing": (zero_crossing, ["zero_crossing"]),
+    "sma": (signal_magnitude_area, None),
+    "jerk": (jerk, ["jerk_mean", "jerk_max"]),
+    "cross_correlation": (cross_correlation, None),
+}
+DEFAULT_FEATURE_GROUPS = ("stats",)
+
+
+class FeatureBank:
+    """Extracts the chosen feature groups for a batch of frames, group after group in the order given.
+
+    FeatureBank() gives exactly extract_batch's features, so models trained before the bank existed are unaffected.
+    The spectral groups share one rfft over the frame axis of the whole batch.
+    """
+    def __init__(self, groups=DEFAULT_FEATURE_GROUPS):
+        unknown = [group for group in groups if group not in FEATURE_GROUPS]
+        if unknown:
+            raise ValueError("Unknown feature groups " + ", ".join(unknown))
+        self.groups = tuple(groups)
+
+    def __call__(self, frames):
+        batch = frames if isinstance(frames, FrameBatch) else FrameBatch(frames)
+        blocks = [FEATURE_GROUPS[group][0](batch) for group in self.groups]
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=1)
+
+    def from_frame(self, frame):
+        return self(np.asarray(frame, dtype=np.float64)[np.newaxis])[0]
+
+    def names(self, n_channels=12):
+        names = []
+        for group in self.groups:
+            per_channel = FEATURE_GROUPS[group][1]
+            if group == "sma":
+                names += ["sma" + str(triad) for triad in range(n_channels // 3)]
+            elif group == "cross_correlation":
+                names += ["xcorr" + str(channel) for channel in range(n_channels // HANDS)]
+            else:
+                names += [name + "_" + str(channel) for channel in range(n_channels) for name in per_channel]
+        return names
+
+    def timings(self, frames, repeat=5):
+        """Seconds per frame each group takes on its own (shared intermediates included), best of repeat runs"""
+        timings = {}
+        for group in self.groups:
+            best = float("inf")
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                FEATURE_GROUPS[group][0](FrameBatch(frames))
+                best = min(best, time.perf_counter() - start_time)
+            timings[group] = best / len(frames)
+        return timings
+
+    def __repr__(self):
+        return "FeatureBank(" + ",".join(self.groups) + ")"
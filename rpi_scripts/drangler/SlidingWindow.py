@@ -0,0 +1,92 @@
+from bisect import bisect_left, insort
+
+import numpy as np
+
+from drangler.FeatureExtractor import FEATURES_PER_SIGNAL
+
+
+class SlidingFeatureWindow:
+    """Keeps get_features_from_frame up to date over the last frame_length readings, one reading at a time.
+
+    Mean and variance are updated with a sliding Welford step, and every channel keeps its window in a sorted
+    list, so median, iqr, max and min are read straight off it. Pushing a reading costs O(log L) comparisons
+    per channel instead of recomputing all statistics over the frame.
+    """
+    def __init__(self, frame_length, n_channels=12):
+        self.frame_length = frame_length
+        self.n_channels = n_channels
+        self.window = np.zeros((frame_length, n_channels))  # Ring of raw readings, oldest at self.position
+        self.sorted_window = [[] for _ in range(n_channels)]
+        self.mean = np.zeros(n_channels)
+        self.m2 = np.zeros(n_channels)  # Sum of squared deviations from the mean
+        self.position = 0
+        self.count = 0
+
+    def reset(self):
+        self.sorted_window = [[] for _ in range(self.n_channels)]
+        self.mean[:] = 0.0
+        self.m2[:] = 0.0
+        self.position = 0
+        self.count = 0
+
+    def is_full(self):
+        return self.count == self.frame_length
+
+    def push(self, reading):
+        reading = np.asarray(reading, dtype=np.float64)
+        if self.count < self.frame_length:
+            self.count += 1
+            delta = reading - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (reading - self.mean)
+            for channel, value in enumerate(reading):
+                insort(self.sorted_window[channel], value)
+        else:
+            evicted = self.window[self.position]
+            new_mean = self.mean + (reading - evicted) / self.frame_length
+            self.m2 += (reading - evicted) * (reading - new_mean + evicted - self.mean)
+            self.mean = new_mean
+            for channel, value in enumerate(reading):
+                channel_window = self.sorted_window[channel]
+                del channel_window[bisect_left(channel_window, evicted[channel])]
+                insort(channel_window, value)
+
+        self.window[self.position] = reading
+        self.position = (self.position + 1) % self.frame_length
+
+        # Ring is in time order once per wrap; resync the running moments to stop rounding drift
+        if self.position == 0 and self.is_full():
+            self.mean = np.mean(self.window, axis=0)
+            self.m2 = np.var(self.window, axis=0) * self.frame_length
+
+    def frame(self):
+        """Returns the current window as a (frame_length, n_channels) array in time order"""
+        return np.roll(self.window, -self.position, axis=0)
+
+    def features(self):
+        """Returns the same feature row as get_features_from_frame(self.frame()), to within rounding"""
+        if not self.is_full():
+            raise ValueError("window not full")
+        length = self.frame_length
+        ordered = np.array(self.sorted_window)  # (n_channels, frame_length), each row ascending
+        var = np.maximum(self.m2 / length, 0.0)
+
+        features = np.empty((self.n_channels, FEATURES_PER_SIGNAL))
+        features[:, 0] = self.mean                                                # mean
+        features[:, 1] = var                                                      # var
+        features[:, 2] = (ordered[:, (length - 1) // 2] + ordered[:, length // 2]) / 2.0  # median
+        features[:, 3] = percentile(ordered, 75) - percentile(ordered, 25)        # iqr
+        features[:, 4] = np.sqrt(var)                                             # std
+        features[:, 5] = ordered[:, -1]                                           # max
+        features[:, 6] = ordered[:, 0]                                            # min
+        features[:, 7] = np.mean(np.absolute(self.window - self.mean), axis=0)    # mad
+        return features.reshape(-1)
+
+
+def percentile(ordered, q):
+    """Linear interpolation percentile (numpy's default) over the last axis of already sorted rows"""
+    index = q / 100.0 * (ordered.shape[-1] - 1)
+    lower = int(np.floor(index))
+    upper = min(lower + 1, ordered.shape[-1] - 1)
+    fraction = index - lower
+    return ordered[:, lower] + (ordered[:, upper] - ordered[:, lower]) * fraction
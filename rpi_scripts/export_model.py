@@ -0,0 +1,42 @@
+"""Exports joblib model artifacts to the flat, memory-mappable model format RpiMLClient loads at startup.
+
+Every model.sav gets a model.drm next to it; RpiMLClient("model.sav") then maps the .drm instead of unpickling.
+
+Usage (from rpi_scripts/): python export_model.py trained_models/trained_model_rf_full1.sav [...]
+"""
+import argparse
+import os
+import time
+
+from drangler.CompiledModel import compile_model, load_compiled, save_compiled
+from rpi_client import load_sklearn_model
+
+
+def export_model(file_path):
+    """Writes the flat model next to file_path; returns its path"""
+    flat_path = os.path.splitext(file_path)[0] + ".drm"
+    save_compiled(compile_model(load_sklearn_model(file_path)), flat_path)
+    return flat_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('models', nargs='+', help="Model files (.sav) to export")
+    args = parser.parse_args()
+
+    for file_path in args.models:
+        try:
+            start_time = time.perf_counter()
+            flat_path = export_model(file_path)
+            joblib_seconds = time.perf_counter() - start_time
+        except Exception as e:
+            print(file_path, "could not be exported:", repr(e))
+            continue
+        start_time = time.perf_counter()
+        load_compiled(flat_path)
+        print(file_path, "->", flat_path, "({:.1f} MB), joblib load + compile: {:.3f}s, flat load: {:.5f}s".format(
+            os.path.getsize(flat_path) / 2 ** 20, joblib_seconds, time.perf_counter() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Hot path timing: perf_counter_ns spans feeding fixed-bucket latency histograms, one per span name.
+
+Disabled by default; span() then hands out a shared no-op span, so an instrumented block costs one function call.
+Call enable() first (rpi_client.py --instrument), then read report() periodically or send the process SIGUSR1.
+"""
+import signal
+import sys
+import threading
+from time import perf_counter_ns
+
+enabled = False
+histograms = {}  # Span name -> LatencyHistogram
+histograms_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """HDR-style histogram of nanosecond durations: exact below 2 * SUB_BUCKETS ns, above that every power of two
+    is split into SUB_BUCKETS equal buckets (about 3% precision), so recording is a few integer operations"""
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    MAX_SHIFT = 40  # Buckets reach 2^46 ns (about 19 hours); longer spans land in the last bucket
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_SHIFT + 2) * self.SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    @classmethod
+    def bucket_of(cls, nanoseconds):
+        shift = nanoseconds.bit_length() - cls.SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            return nanoseconds
+        if shift > cls.MAX_SHIFT:
+            return (cls.MAX_SHIFT + 2) * cls.SUB_BUCKETS - 1
+        return shift * cls.SUB_BUCKETS + (nanoseconds >> shift)
+
+    @classmethod
+    def bucket_bounds(cls, bucket):
+        if bucket < 2 * cls.SUB_BUCKETS:
+            return bucket, bucket + 1
+        shift = bucket // cls.SUB_BUCKETS - 1
+        mantissa = bucket - shift * cls.SUB_BUCKETS
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, nanoseconds):
+        nanoseconds = max(0, int(nanoseconds))
+        self.counts[self.bucket_of(nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.maximum:
+            self.maximum = nanoseconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, in ns (never above the maximum seen)"""
+        if self.count == 0:
+            return 0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return min(self.bucket_bounds(bucket)[1], self.maximum)
+        return self.maximum
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+
+def histogram(name):
+    if name not in histograms:
+        with histograms_lock:
+            histograms.setdefault(name, LatencyHistogram())
+    return histograms[name]
+
+
+class Span:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, name):
+        self.histogram = histogram(name)
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(perf_counter_ns() - self.start)
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+    """with span("parse"): ... times the block into the "parse" histogram when instrumentation is enabled"""
+    return Span(name) if enabled else NULL_SPAN
+
+
+def record(name, nanoseconds):
+    """Adds a duration measured elsewhere (e.g. by a pipeline stage) to the name histogram"""
+    if enabled:
+        histogram(name).record(nanoseconds)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def report():
+    lines = ["{:<20} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "span", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+    for name in sorted(histograms):
+        histogram = histograms[name]
+        lines.append("{:<20} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            name, histogram.count, histogram.mean() / 1e6, histogram.percentile(50) / 1e6,
+            histogram.percentile(95) / 1e6, histogram.percentile(99) / 1e6, histogram.maximum / 1e6))
+    return "\n".join(lines)
+
+
+def install_signal_handler(signum=getattr(signal, 'SIGUSR1', None), stream=sys.stderr):
+    """Prints report() whenever the process receives signum (SIGUSR1: kill -USR1 <pid>); main thread only"""
+    if signum is not None:
+        signal.signal(signum, lambda *_: print(report(), file=stream, flush=True))
@@ -0,0 +1,47 @@
+"""Deferred imports for heavy modules, with a record of what every import cost for the startup report"""
+import importlib
+import sys
+import time
+
+import_times = {}  # Module name -> seconds its import took, in import order
+
+
+def load_module(name):
+    """Imports name now if nothing has yet, timing the import"""
+    module = sys.modules.get(name)
+    if module is None:
+        start_time = time.perf_counter()
+        module = importlib.import_module(name)
+        import_times[name] = time.perf_counter() - start_time
+    return module
+
+
+class LazyModule:
+    """Stands in for a module in namespace until one of its attributes is used; the module is then imported and
+    bound in place of the stand-in, so later lookups cost the same as with a plain import"""
+    def __init__(self, name, namespace, alias):
+        self.name = name
+        self.namespace = namespace
+        self.alias = alias
+
+    def __getattr__(self, attribute):
+        module = load_module(self.name)
+        self.namespace[self.alias] = module
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return "<lazy module " + self.name + ">"
+
+
+def lazy_module(name, namespace, alias=None):
+    """Use as numpy = lazy_module("numpy", globals())"""
+    return LazyModule(name, namespace, alias or name.rpartition('.')[2])
+
+
+def import_report(startup_time=None):
+    """Import costs, slowest first, as printable lines"""
+    lines = ["{:<32} {:>9.1f} ms".format(name, seconds * 1000.0)
+             for name, seconds in sorted(import_times.items(), key=lambda item: -item[1])]
+    if startup_time is not None:
+        lines.append("{:<32} {:>9.1f} ms".format("total since start", (time.perf_counter() - startup_time) * 1000.0))
+    return "\n".join(lines)
@@ -0,0 +1,24 @@
+"""Binary framing loopback without a Mega or a user: a fake Mega on a pty pair streams random readings through
+RpiMegaClient's handshake, reader thread and binary parser. Exits non-zero when anything arrives changed or missing.
+
+Usage (from rpi_scripts/): python loopback_test.py [-n 500] [-r 3]
+"""
+import argparse
+import sys
+
+from rpi_client import binary_loopback_test
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary framing loopback over a pty pair")
+    parser.add_argument('-n', '--readings', type=int, default=500, help="Movement readings per run")
+    parser.add_argument('-r', '--runs', type=int, default=1, help="Number of runs")
+    args = parser.parse_args()
+
+    failures = sum(not binary_loopback_test(args.readings) for _ in range(args.runs))
+    print(str(args.runs - failures) + "/" + str(args.runs) + " runs passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
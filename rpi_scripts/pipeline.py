@@ -0,0 +1,147 @@
+"""Bounded-queue pipeline of stages, each on its own thread and optionally backed by a process pool"""
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+
+
+class Stage:
+    """Applies function to every item from the previous stage, in order, and passes non-None results on.
+
+    A stage without a previous stage is a source: function is called with no arguments, repeatedly. With
+    processes > 0 items are handed to a process pool (function must be a picklable top level function and
+    should hold no state; initializer/initargs run once per worker process).
+    """
+    def __init__(self, name, function, queue_size=8, processes=0, initializer=None, initargs=()):
+        self.name = name
+        self.function = function
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.next_stage = None
+        self.is_source = False
+        self.stop_event = None
+        self.thread = None
+
+        # Counters
+        self.items = 0
+        self.filtered = 0  # Items the function consumed without output (returned None)
+        self.busy_time = 0.0  # Seconds spent in function (or waiting on the pool)
+        self.max_latency = 0.0
+        self.start_time = None
+
+    def start(self, stop_event):
+        self.stop_event = stop_event
+        self.start_time = time.perf_counter()
+        target = self.run_pool if self.processes > 0 and not self.is_source else self.run
+        self.thread = threading.Thread(target=target, name=self.name, daemon=True)
+        self.thread.start()
+
+    def next_item(self):
+        while not self.stop_event.is_set():
+            try:
+                return self.input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def forward(self, result, latency):
+        if result is None and self.is_source:
+            return  # Source had nothing ready yet
+        self.items += 1
+        self.busy_time += latency
+        instrumentation.record("stage." + self.name, latency * 1e9)
+        self.max_latency = max(self.max_latency, latency)
+        if result is None:
+            self.filtered += 1
+        elif self.next_stage is not None:
+            while not self.stop_event.is_set():
+                try:
+                    self.next_stage.input_queue.put(result, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.is_source:
+                item = ()
+            else:
+                item = self.next_item()
+                if item is None:
+                    break
+            start_time = time.perf_counter()
+            try:
+                result = self.function(*item) if self.is_source else self.function(item)
+            except Exception:
+                logging.exception("Pipeline stage " + self.name + " failed on an item")
+                result = None
+            self.forward(result, time.perf_counter() - start_time)
+
+    def run_pool(self):
+        # Keeps up to one item per worker in flight, results are forwarded in submission order
+        in_flight = collections.deque()
+        with ProcessPoolExecutor(self.processes, initializer=self.initializer, initargs=self.initargs) as pool:
+            while not self.stop_event.is_set():
+                if len(in_flight) < self.processes and (len(in_flight) == 0 or not self.input_queue.empty()):
+                    item = self.next_item()
+                    if item is None:
+                        break
+                    in_flight.append((time.perf_counter(), pool.submit(self.function, item)))
+                    continue
+                start_time, future = in_flight.popleft()
+                try:
+                    result = future.result()
+                except Exception:
+                    logging.exception("Pipeline stage " + self.name + " failed on an item")
+                    result = None
+                self.forward(result, time.perf_counter() - start_time)
+            for _, future in in_flight:
+                future.cancel()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.0
+        return {
+            'items': self.items,
+            'filtered': self.filtered,
+            'throughput': self.items / elapsed if elapsed > 0 else 0.0,  # items per second
+            'mean_latency_ms': self.busy_time / self.items * 1000.0 if self.items > 0 else 0.0,
+            'max_latency_ms': self.max_latency * 1000.0,
+            'queue_depth': self.input_queue.qsize(),
+        }
+
+
+class Pipeline:
+    """Chains stages in the given order; the first stage is the source"""
+    def __init__(self, stages):
+        self.stages = stages
+        self.stop_event = threading.Event()
+        stages[0].is_source = True
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+
+    def start(self):
+        for stage in reversed(self.stages):
+            stage.start(self.stop_event)
+
+    def stop(self):
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.thread.join()
+
+    def is_running(self):
+        return not self.stop_event.is_set() and all(stage.thread.is_alive() for stage in self.stages)
+
+    def report(self):
+        lines = []
+        for stage in self.stages:
+            stats = stage.stats()
+            lines.append("{:<10} items:{:<6} filtered:{:<5} {:>8.2f}/s  mean:{:>8.3f}ms  max:{:>8.3f}ms  queued:{}".format(
+                stage.name, stats['items'], stats['filtered'], stats['throughput'], stats['mean_latency_ms'],
+                stats['max_latency_ms'], stats['queue_depth']))
+        return "\n".join(lines)
@@ -0,0 +1,391 @@
+"""Offline replay of a whole evaluation session: recorded readings -> Pi pipeline -> stand-in eval server.
+
+A fake Mega streams training_data frames (or a raw serial log) as real checksummed messages through the real
+RpiMegaClient reader, the real pipeline classifies them, and the real RpiEvalServerClient sends encrypted
+results to an in-process stand-in for final_eval_server_5moves.Server. Pacing runs on a clock that can be
+sped up; measured compute costs are not scaled, so use --speed 1 for faithful latencies.
+
+Usage (from rpi_scripts/): python replay.py -M trained_models/trained_model_rf_full1.sav [-n 20] [-s 4] [-o log.csv]
+"""
+import argparse
+import csv
+import glob
+import logging
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+
+import numpy
+
+import instrumentation
+import rpi_client
+import telemetry
+from dataset import TrainingDataset
+from decision import DECISION_ENGINES, make_decision_engine
+from rpi_client import (MessageParser, MessageType, Move, RpiEvalServerClient, RpiMegaClient, RpiMLClient,
+                        build_evaluation_pipeline)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "eval_scripts"))
+from server_auth import StreamDecoder, server_auth
+
+LOG_COLUMNS = ['timestamp', 'action', 'goal', 'time_delta', 'correct', 'voltage', 'current', 'power', 'cumpower']
+SESSION_ACTIONS = ['hunchback', 'raffles', 'chicken', 'crab', 'cowboy', 'runningman', 'jamesbond', 'snake',
+                   'doublepump', 'mermaid']
+
+
+class ReplayClock:
+    """Wall clock running speed times faster than real time; stands in for the time module during a replay"""
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.real_start = time.time()
+        self.perf_start = time.perf_counter()
+
+    def time(self):
+        return self.real_start + (time.perf_counter() - self.perf_start) * self.speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class Dancer:
+    """Performs whichever move it is told to, by handing out that move's recorded readings in order"""
+    def __init__(self, data_pattern):
+        self.recordings = {}
+        if os.path.isdir(data_pattern):
+            dataset = TrainingDataset(data_pattern)
+            for session in range(len(dataset.session_names)):
+                frame_length, _, overlap = dataset.session_params(session)
+                self.add_recording(dataset.session_move(session), dataset.session(session), frame_length, overlap)
+        else:
+            for file_name in sorted(glob.glob(data_pattern)):
+                match = re.search(r'_([A-Z]+)L(\d+)SI[\d.]+R([\d.]+)\(', os.path.basename(file_name))
+                if match is None:
+                    continue
+                self.add_recording(match.group(1), numpy.load(file_name), int(match.group(2)), float(match.group(3)))
+        self.move = None
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def add_recording(self, move, frames, frame_length, overlap):
+        if len(frames) == 0:
+            return
+        hop = max(1, int(frame_length * (1 - overlap)))
+        # Overlapping frames back into one continuous stream of readings
+        readings = numpy.concatenate([frames[0], frames[1:, -hop:].reshape(-1, frames.shape[2])])
+        if move in self.recordings:
+            readings = numpy.concatenate([self.recordings[move], readings])
+        self.recordings[move] = readings
+
+    def perform(self, action):
+        with self.lock:
+            self.move = Move.FINAL.name if action == "logout" else action.upper()
+            self.position = random.randrange(len(self.recordings[self.move]))
+
+    def next_reading(self):
+        with self.lock:
+            if self.move is None:
+                return numpy.zeros(12)
+            readings = self.recordings[self.move]
+            reading = readings[self.position % len(readings)]
+            self.position += 1
+            return reading
+
+
+class TracePlayer:
+    """Stands in for the dancer on the port: hands out the movement readings of a telemetry trace in recorded order,
+    whatever move is prompted (so the server's accuracy is meaningless, the pipeline sees what the Pi saw)"""
+    def __init__(self, file_path):
+        self.readings = telemetry.trace_readings(file_path)
+        if len(self.readings) == 0:
+            raise ValueError(file_path + " holds no movement readings")
+        self.position = 0
+
+    def next_reading(self):
+        reading = self.readings[self.position % len(self.readings)]
+        self.position += 1
+        return reading
+
+
+class ReplayPort:
+    """Pretends to be the Mega on the other end of serial.Serial: answers the handshake, then streams readings
+    (with a power reading every power_interval samples) at sample_rate per clock second"""
+    def __init__(self, dancer, clock, sample_rate=20.0, binary=False, raw_log=None, baudrate=115200, power_interval=10):
+        self.dancer = dancer
+        self.clock = clock
+        self.sample_rate = sample_rate
+        self.binary = binary  # Whether to accept an "HB" handshake
+        self.binary_mode = False
+        self.raw_log = raw_log  # Recorded serial bytes to stream verbatim instead of generated messages
+        self.raw_position = 0
+        self.byte_rate = baudrate / 10.0
+        self.power_interval = power_interval
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.streaming = False
+        self.next_sample_time = 0.0
+        self.serial_number = 0
+        self.is_open = True
+
+    def write(self, data):
+        with self.lock:
+            for line in bytes(data).split(b'\n'):
+                if line == b'H' or line == b'HB':
+                    self.binary_mode = self.binary and line == b'HB'
+                    self.buffer += b'AB\n' if self.binary_mode else b'A\n'
+                elif line == b'S' and not self.streaming:
+                    self.streaming = True
+                    self.next_sample_time = self.clock.time()
+        return len(data)
+
+    def generate(self):
+        now = self.clock.time()
+        while self.streaming and self.next_sample_time <= now:
+            if self.raw_log is not None:
+                chunk = self.raw_log[self.raw_position:self.raw_position + 64]
+                self.raw_position = (self.raw_position + 64) % len(self.raw_log)
+                self.buffer += chunk
+                self.next_sample_time += len(chunk) / self.byte_rate
+                continue
+            self.buffer += self.encode(MessageType.MOVEMENT, self.dancer.next_reading())
+            if self.serial_number % self.power_interval == 0:
+                self.buffer += self.encode(MessageType.POWER, [5.0, 1.2])
+            self.next_sample_time += 1.0 / self.sample_rate
+
+    def encode(self, message_type, readings):
+        self.serial_number += 1
+        if self.binary_mode:
+            return MessageParser.encode_binary(message_type, self.serial_number, readings)
+        return MessageParser.encode(self.serial_number, message_type, readings)
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.generate()
+            return len(self.buffer)
+
+    def read(self, size=1):
+        while True:
+            with self.lock:
+                self.generate()
+                if len(self.buffer) > 0 or self.cancelled.is_set():
+                    self.cancelled.clear()
+                    data = bytes(self.buffer[:size])
+                    del self.buffer[:size]
+                    return data
+                wait = self.next_sample_time - self.clock.time() if self.streaming else 0.01
+            self.clock.sleep(min(max(wait, 0.0), 0.05))
+
+    def read_until(self, expected=b'\n'):
+        data = b''
+        while not data.endswith(expected):
+            byte = self.read(1)
+            if len(byte) == 0:
+                break
+            data += byte
+        return data
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.generate()
+            self.buffer.clear()
+
+    def cancel_read(self):
+        self.cancelled.set()
+
+
+class ReplayMegaClient(RpiMegaClient):
+    """RpiMegaClient wired to a ReplayPort instead of /dev/ttyAMA0"""
+    def __init__(self, port, binary=False):
+        self.binary_requested = binary
+        self.binary_mode = False
+        self.port = port
+
+
+class ReplayEvalServer(threading.Thread):
+    """In-process stand-in for final_eval_server_5moves.Server: prompts each action in turn (making the dancer
+    perform it), decrypts the answers and logs them in the same columns, with the same action timeout"""
+    def __init__(self, dancer, clock, key, actions, timeout=30):
+        threading.Thread.__init__(self, daemon=True)
+        self.dancer = dancer
+        self.clock = clock
+        self.key = key
+        self.actions = actions
+        self.timeout = timeout
+        self.auth = server_auth()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port_num = self.sock.getsockname()[1]
+        self.session_started = threading.Event()
+        self.done = threading.Event()
+        self.rows = []
+        self.action = None
+        self.action_index = -1
+        self.action_set_time = None
+
+    def run(self):
+        connection, _ = self.sock.accept()
+        connection.settimeout(0.05)
+        decoder = StreamDecoder()
+        self.session_started.wait()
+        self.next_action()
+        while not self.done.is_set():
+            try:
+                data = connection.recv(1024)
+            except socket.timeout:
+                if self.clock.time() - self.action_set_time > self.timeout:
+                    self.log_move_made("None", 0, 0, 0, 0)
+                    print("ACTION TIMEOUT")
+                    self.next_action()
+                continue
+            if not data:
+                break
+            for message in decoder.feed(data):
+                try:
+                    results = self.auth.decryptBatch(message.decode("utf8"), self.key)
+                except Exception as e:
+                    print(e)
+                    continue
+                for decoded in results:
+                    if self.done.is_set():
+                        break
+                    self.log_move_made(decoded['action'], decoded['voltage'], decoded['current'], decoded['power'],
+                                       decoded['cumpower'])
+                    self.next_action()
+        connection.close()
+        self.sock.close()
+        self.done.set()
+
+    def next_action(self):
+        self.action_index += 1
+        if self.action_index >= len(self.actions):
+            self.done.set()
+            return
+        self.action = self.actions[self.action_index]
+        self.dancer.perform(self.action)
+        self.action_set_time = self.clock.time()
+        print("NEW ACTION :: {}".format(self.action))
+
+    def log_move_made(self, action_made, voltage, current, power, cumpower):
+        timestamp = self.clock.time()
+        self.rows.append({'timestamp': timestamp, 'action': action_made, 'goal': self.action,
+                          'time_delta': timestamp - self.action_set_time, 'correct': self.action == action_made,
+                          'voltage': voltage, 'current': current, 'power': power, 'cumpower': cumpower})
+
+
+def summarize(rows):
+    time_deltas = numpy.array([row['time_delta'] for row in rows])
+    correct = numpy.array([row['correct'] for row in rows])
+    print('Moves:                   ' + str(len(rows)))
+    if len(rows) > 0:
+        print('Mean Time:               ' + str(numpy.mean(time_deltas)))
+        print('Median Time:             ' + str(numpy.median(time_deltas)))
+        print('MaxDelay:           ' + str(numpy.max(time_deltas)))
+        print('MinDelay:           ' + str(numpy.min(time_deltas)))
+        print('PercentAccuracy:    ' + str(numpy.mean(correct) * 100))
+
+
+def write_log(rows, file_path):
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=LOG_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def replay_session(model_path, data_pattern="training_data/*.npy", moves_per_action=2, speed=1.0, sample_rate=20.0,
+                   decision=None, stage_processes=None, binary=False, raw_log=None, key="0123456789abcdef", seed=0,
+                   trace=None):
+    """Runs one replayed evaluation session; returns the server's log rows, the pipeline and the server client.
+    trace is a telemetry trace whose readings are streamed instead of the dancer's."""
+    random.seed(seed)
+    numpy.random.seed(seed)
+    clock = ReplayClock(speed)
+    rpi_client.time = clock  # Pace the client's sleeps and timestamps on the replay clock
+    rpi_client.evaluation_start_time = int(clock.time())
+
+    dancer = Dancer(data_pattern)
+    actions = [action for action in SESSION_ACTIONS if action.upper() in dancer.recordings] * moves_per_action
+    random.shuffle(actions)
+    server = ReplayEvalServer(dancer, clock, key, actions)
+    server.start()
+
+    port = ReplayPort(TracePlayer(trace) if trace is not None else dancer, clock, sample_rate, binary=binary,
+                      raw_log=raw_log)
+    mega_client = ReplayMegaClient(port, binary=binary)
+    server_client = RpiEvalServerClient('127.0.0.1', str(server.port_num), key)
+    ml_client = RpiMLClient(model_path)
+
+    mega_client.three_way_handshake()
+    mega_client.start_reader()
+    mega_client.send_message("S")
+    evaluation_pipeline = build_evaluation_pipeline(mega_client, server_client, ml_client, stage_processes, decision)
+    evaluation_pipeline.start()
+    server.session_started.set()
+    while not server.done.wait(0.5) and evaluation_pipeline.is_running():
+        pass
+    evaluation_pipeline.stop()
+    mega_client.stop_reader()
+    server_client.flush(5.0)
+    server_client.close()
+    return server.rows, evaluation_pipeline, server_client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-M', '--model', help="Model file to evaluate", required=True)
+    parser.add_argument('-D', '--data', help="Glob of recorded training data chunks, or a dataset.py store directory", default="training_data/*.npy")
+    parser.add_argument('-r', '--raw_log', help="Raw serial capture to stream instead of training data")
+    parser.add_argument('-T', '--trace', help="Telemetry trace (rpi_client.py --trace) to stream instead of training data")
+    parser.add_argument('--record_trace', help="Write a telemetry trace of this replay to this file")
+    parser.add_argument('-n', '--moves_per_action', help="Times each action is prompted", type=int, default=2)
+    parser.add_argument('-s', '--speed', help="Replay clock speed-up factor", type=float, default=1.0)
+    parser.add_argument('-R', '--sample_rate', help="Readings per (replay clock) second", type=float, default=20.0)
+    parser.add_argument('-d', '--decision', help="Move decision engine", choices=sorted(DECISION_ENGINES),
+                        default='consecutive')
+    parser.add_argument('-t', '--threshold', help="Confidence threshold for the ema / sprt decision engines", type=float)
+    parser.add_argument('-m', '--max_frames', help="Most frames the ema / sprt decision engines wait for", type=int)
+    parser.add_argument('-j', '--stage_processes', help="Worker processes per pipeline stage, e.g. features=2",
+                        nargs='*', default=[])
+    parser.add_argument('-w', '--binary', help="Replay with binary framing", action='store_true')
+    parser.add_argument('-o', '--output', help="Write the server log (same columns as the eval server) to this CSV")
+    parser.add_argument('-l', '--logging_mode', help="Enables info / debug printing (info/debug/none)", default="none")
+    parser.add_argument('-i', '--instrument', help="Report hot path latency histograms", action='store_true')
+    args = parser.parse_args()
+    if args.logging_mode in ("info", "debug"):
+        telemetry.start_logging(logging.DEBUG if args.logging_mode == "debug" else logging.INFO)
+    if args.record_trace is not None:
+        telemetry.start_trace(args.record_trace)
+    if args.instrument:
+        instrumentation.enable()
+
+    raw_log = None
+    if args.raw_log is not None:
+        with open(args.raw_log, 'rb') as f:
+            raw_log = f.read()
+    stage_processes = {name: int(count) for name, count in (pair.split("=") for pair in args.stage_processes)}
+    rows, evaluation_pipeline, server_client = replay_session(
+        args.model, args.data, args.moves_per_action, args.speed, args.sample_rate,
+        make_decision_engine(args.decision, args.threshold, args.max_frames), stage_processes, args.binary, raw_log,
+        trace=args.trace)
+
+    print("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@")
+    summarize(rows)
+    print(evaluation_pipeline.report())
+    print("Server sends -", server_client.send_latency.report())
+    if args.instrument:
+        print(instrumentation.report())
+    if args.output is not None:
+        write_log(rows, args.output)
+        print("Server log written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,41 @@
 # Standard library imports
+import time
+startup_time = time.perf_counter()  # Start of the --import_report timings
 import argparse
+import atexit
+import binascii
+import json
 import logging
+import os
+import queue
+import select
+import struct
 import sys
+import threading
 from enum import Enum
 
 # Third party imports
+# Heavy modules are only imported once a mode uses them (numpy alone takes a while on the Pi, scipy via
+# FeatureExtractor several seconds); --import_report lists what each import cost
+from lazy_import import import_report, lazy_module
 # General
-import time
 import datetime
 # Communication
-import serial
+serial = lazy_module("serial", globals())
 import socket
 # Crypto
 import base64
-from Crypto.Cipher import AES
-from Crypto import Random
+AES = lazy_module("Crypto.Cipher.AES", globals())
 # ML
-import numpy
+numpy = lazy_module("numpy", globals())
 #import pickle
-from sklearn.externals import joblib
-from drangler.FeatureExtractor import get_features_from_frame
+FeatureExtractor = lazy_module("drangler.FeatureExtractor", globals())
+CompiledModel = lazy_module("drangler.CompiledModel", globals())
+SlidingWindow = lazy_module("drangler.SlidingWindow", globals())
+import instrumentation
+import telemetry
+from pipeline import Pipeline, Stage
+from decision import DECISION_ENGINES, ConsecutiveMatchDecision, make_decision_engine
 
 # Global Flags
 frame_length = 20  # 1 frame per prediction
@@ -29,18 +45,75 @@ overlap_ratio = 0.5
 global evaluation_start_time
 evaluation_start_time = int(time.time())
 
+def load_sklearn_model(file_path):
+    try:
+        from sklearn.externals import joblib
+    except ImportError:  # sklearn >= 0.23 dropped the vendored copy
+        import joblib
+    return joblib.load(file_path)
+    #return pickle.load(open(file_path, "rb"))
+
+
+def model_feature_groups(file_path):
+    """Feature groups a model was trained on, from the metadata train.py writes next to it (default: the statistics)"""
+    try:
+        with open(os.path.splitext(file_path)[0] + ".json") as f:
+            return json.load(f).get('feature_groups', FeatureExtractor.DEFAULT_FEATURE_GROUPS)
+    except (OSError, ValueError):
+        return FeatureExtractor.DEFAULT_FEATURE_GROUPS
+
+
 # Client for ML prediction, training data generation
 class RpiMLClient:
+    """Classifies frames with a compiled model.
+
+    file_path may be a joblib .sav or a flat model file (export_model.py, .drm). A .drm, or a .drm next to the
+    .sav that is at least as new, is memory-mapped instead of unpickling the sklearn model; the sklearn model is
+    then only loaded if self.model is used. Frames are turned into the FeatureBank groups the model was trained on.
+    """
     def __init__(self, file_path):
-        self.model = joblib.load(file_path)
-        #self.model = pickle.load(open(file_path, "rb"))
+        self.file_path = file_path
+        self.sklearn_model = None
+        self.feature_bank = FeatureExtractor.FeatureBank(model_feature_groups(file_path))
+        flat_path = os.path.splitext(file_path)[0] + ".drm"
+        if CompiledModel.is_compiled_file(file_path):
+            self.compiled_model = CompiledModel.load_compiled(file_path)
+        elif os.path.isfile(flat_path) and os.path.getmtime(flat_path) >= os.path.getmtime(file_path):
+            self.compiled_model = CompiledModel.load_compiled(flat_path)
+        else:
+            self.sklearn_model = load_sklearn_model(file_path)
+            self.compiled_model = CompiledModel.compile_model(self.sklearn_model)  # Label and probabilities from a single traversal
+
+    # The sklearn model behind the compiled one, loaded on first use; None if there is no .sav for a .drm
+    @property
+    def model(self):
+        if self.sklearn_model is None:
+            sklearn_path = self.file_path
+            if CompiledModel.is_compiled_file(sklearn_path):
+                sklearn_path = os.path.splitext(sklearn_path)[0] + ".sav"
+                if not os.path.isfile(sklearn_path):
+                    return None
+            self.sklearn_model = load_sklearn_model(sklearn_path)
+        return self.sklearn_model
 
     # Returns dance move classified as a lowercase string
     def classify(self, input_frame):
-        feature_frame = get_features_from_frame(numpy.array(input_frame))
-        result = int(self.model.predict(feature_frame.reshape(1, -1))[0])
+        return self.classify_features(self.feature_bank.from_frame(input_frame))
+
+    # Same as classify, for a feature row that has already been computed (e.g. by SlidingFeatureWindow)
+    def classify_features(self, feature_frame):
+        return self.classify_with_probabilities(feature_frame)[0]
 
-        logging.info(self.model.predict_proba(feature_frame.reshape(1, -1))[0])
+    # Returns (dance move, class probabilities ordered as self.compiled_model.classes)
+    def classify_with_probabilities(self, feature_frame):
+        label, probabilities = self.compiled_model.predict(feature_frame)
+        logging.debug("Class probabilities: %s", probabilities)
+        return self.action_name(label), probabilities
+
+    # Maps a model class label to its dance move as a lowercase string
+    @staticmethod
+    def action_name(label):
+        result = int(label)
         if result == Move.FINAL.value:
             return "logout"
         elif result == Move.HUNCHBACK.value:
@@ -69,7 +142,9 @@ class RpiMLClient:
 
 # Client for Mega communications
 class RpiMegaClient:
-    def __init__(self, terminal="/dev/ttyAMA0", baudrate=115200):
+    def __init__(self, terminal="/dev/ttyAMA0", baudrate=115200, binary=False):
+        self.binary_requested = binary  # Offer binary framing during the handshake
+        self.binary_mode = False
         try:
             self.port = serial.Serial(terminal, baudrate, timeout=None)
             if self.port.is_open:
@@ -87,20 +162,77 @@ class RpiMegaClient:
         return message
 
     def read_message(self):
-        return self.port.read_until().decode("utf-8")  # \n is not removed
+        with instrumentation.span("read_message"):
+            return self.port.read_until().decode("utf-8", errors="replace")  # \n is not removed
 
     def discard_till_sentinel(self):
         self.port.read_until()  # Discards first chunk till \n, bare read may fail on decode
 
+    def start_reader(self, capacity=1024):
+        """Drains the port on a background thread; movement readings land in self.readings, power in self.power_readings"""
+        self.readings = ReadingRingBuffer(capacity)
+        self.power_readings = [0.0, 0.0]
+        self.parse_errors = 0
+        self.consecutive_parse_errors = 0
+        self.reader_running = threading.Event()
+        self.reader_running.set()
+        self.reader_thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        self.reader_running.clear()
+        self.port.cancel_read()  # Unblocks a pending read
+        self.reader_thread.join()
+
+    def read_loop(self):
+        parse_chunk = MessageParser.parse_binary_chunk if self.binary_mode else MessageParser.parse_chunk
+        parsed = numpy.zeros((64, 12))  # Scratch rows for one bulk read
+        pending = b''
+        while self.reader_running.is_set():
+            # Read everything waiting in one call, parse the complete messages in bulk
+            with instrumentation.span("serial_read"):  # Includes waiting for the Mega
+                chunk = pending + self.port.read(max(1, self.port.in_waiting))
+            with instrumentation.span("parse"):
+                rows, power_readings, invalid, pending = parse_chunk(chunk, parsed)
+                while rows == len(parsed):  # Scratch filled up before the chunk was consumed
+                    self.readings.put_many(parsed)
+                    rows, more_power_readings, more_invalid, pending = parse_chunk(pending, parsed)
+                    power_readings = more_power_readings or power_readings
+                    invalid += more_invalid
+            if len(pending) > 512:  # No message is this long; drop runaway garbage without a newline
+                pending = b''
+                invalid += 1
+
+            self.parse_errors += invalid
+            if rows > 0 or power_readings is not None:
+                self.consecutive_parse_errors = invalid
+            else:
+                self.consecutive_parse_errors += invalid
+            if rows > 0:
+                self.readings.put_many(parsed[:rows])
+                telemetry.trace(telemetry.READINGS, parsed[:rows])
+                logging.debug("%d readings received", rows)
+            if power_readings is not None:
+                self.power_readings = power_readings  # Only the latest power reading set is kept
+                telemetry.trace(telemetry.POWER, [power_readings])
+
     def three_way_handshake(self):
+        """H -> A -> A. Sending "HB" instead of "H" offers binary framing, which the Mega accepts by replying "AB".
+
+        Also used to resynchronise mid-stream, when the port may still hold binary frames: those are flushed before
+        every H and the reply is compared as raw bytes, so no decoding can fail on them."""
         logging.info("Entered handshake mode")
         while True:
-            self.send_message("H")
+            self.port.reset_input_buffer()
+            self.send_message("HB" if self.binary_requested else "H")
             logging.debug("H sent")
             logging.debug("Sleep for 1 second")
             time.sleep(1)
-            if self.read_message() == "A\n":
-                logging.debug("A received")
+            with instrumentation.span("read_message"):
+                reply = self.port.read_until()
+            if reply == b"A\n" or reply == b"AB\n":
+                self.binary_mode = reply == b"AB\n"
+                logging.debug("A received, binary framing: " + str(self.binary_mode))
                 self.send_message("A")
                 logging.debug("A sent")
                 logging.debug("Entering sleep for 3 seconds")
@@ -111,31 +243,261 @@ class RpiMegaClient:
                 break
 
 
+class ReadingRingBuffer:
+    """Preallocated ring of movement readings shared by one producer (reader thread) and one consumer.
+
+    Each side only advances its own index, so no lock is needed. Readings arriving while the ring is full are
+    dropped and counted rather than blocking the reader.
+    """
+    def __init__(self, capacity=1024, width=12):
+        self.capacity = capacity
+        self.readings = numpy.zeros((capacity, width))
+        self.write_index = 0  # Only advanced by the producer
+        self.read_index = 0  # Only advanced by the consumer
+        self.dropped = 0
+        self.data_available = threading.Event()
+
+    def __len__(self):
+        return self.write_index - self.read_index
+
+    def put(self, reading):
+        if self.write_index - self.read_index >= self.capacity:
+            self.dropped += 1
+            return False
+        self.readings[self.write_index % self.capacity] = reading
+        self.write_index += 1
+        self.data_available.set()
+        return True
+
+    def put_many(self, readings):
+        """Appends an (n, width) array of readings; returns how many fit, the rest are dropped"""
+        count = min(len(readings), self.capacity - (self.write_index - self.read_index))
+        self.dropped += len(readings) - count
+        if count > 0:
+            indices = (numpy.arange(count) + self.write_index) % self.capacity
+            self.readings[indices] = readings[:count]
+            self.write_index += count
+            self.data_available.set()
+        return count
+
+    def get(self, max_count, timeout=None):
+        """Returns up to max_count of the oldest readings as an (n, width) array, waiting up to timeout for one"""
+        if len(self) == 0:
+            self.data_available.clear()
+            if len(self) == 0 and not self.data_available.wait(timeout):
+                return self.readings[:0].copy()
+        count = min(max_count, len(self))
+        indices = (numpy.arange(count) + self.read_index) % self.capacity
+        readings = self.readings[indices]
+        self.read_index += count
+        return readings
+
+    def flush(self):
+        """Discards every reading received so far"""
+        self.read_index = self.write_index
+
+
+class FrameRingBuffer:
+    """Preallocated ring of readings that hands out overlapping frames as views, without copying.
+
+    Every reading is written twice, at its slot and at slot + capacity, so the frame_length readings starting at
+    any slot are contiguous in memory. A frame is due once frame_length readings follow the previous frame's start
+    plus hop. A frame view stays valid until capacity - frame_length further readings have been appended; the
+    default leaves room for 32 frames in flight (e.g. queued in the evaluation pipeline).
+    """
+    def __init__(self, frame_length, hop, capacity=None, width=12, dtype=None):
+        self.frame_length = frame_length
+        self.hop = max(1, hop)
+        self.capacity = capacity if capacity is not None else frame_length + 32 * self.hop
+        if self.capacity < frame_length:
+            raise ValueError("capacity must hold at least one frame")
+        self.readings = numpy.zeros((2 * self.capacity, width), dtype=dtype or numpy.float64)
+        self.write_index = 0
+        self.frame_start = 0  # Index of the first reading of the next frame
+
+    def pending(self):
+        """Readings still needed before the next frame is due"""
+        return max(0, self.frame_start + self.frame_length - self.write_index)
+
+    def append(self, reading):
+        slot = self.write_index % self.capacity
+        self.readings[slot] = reading
+        self.readings[slot + self.capacity] = reading
+        self.write_index += 1
+
+    def extend(self, readings):
+        """Appends an (n, width) array of readings"""
+        skipped = max(0, len(readings) - self.capacity)  # Would be overwritten straight away
+        readings = readings[skipped:]
+        self.write_index += skipped
+        start = self.write_index % self.capacity
+        end = start + len(readings)
+        self.readings[start:end] = readings  # Never runs past 2 * capacity
+        if end <= self.capacity:
+            self.readings[start + self.capacity:end + self.capacity] = readings
+        else:  # Wrapped: the tail past capacity mirrors to the front
+            self.readings[start + self.capacity:] = readings[:self.capacity - start]
+            self.readings[:end - self.capacity] = readings[self.capacity - start:]
+        self.write_index += len(readings)
+
+    def next_frame(self):
+        """The next (frame_length, width) frame as a view, or None if it is not due yet"""
+        if self.pending() > 0:
+            return None
+        if self.write_index - self.frame_start > self.capacity:  # Fell behind; skip to the latest complete frame
+            self.frame_start = self.write_index - self.frame_length
+        slot = self.frame_start % self.capacity
+        self.frame_start += self.hop
+        return self.readings[slot:slot + self.frame_length]
+
+    def reset(self):
+        """Discards the readings so far; the next frame starts with the next reading appended"""
+        self.frame_start = self.write_index
+
+
 # Client for Server communication
 class RpiEvalServerClient:
-    """Opens connection to remote host socket, provides a send API"""
-    def __init__(self, target_ip, target_port, key):
+    """Keeps a connection to the remote host socket open, provides a non-blocking send API.
+
+    Messages are queued and encrypted/sent by a background thread, so a send never stalls the caller. If the
+    connection drops the thread reconnects with exponential backoff and delivers everything still queued,
+    starting with the message that failed. Queue-to-sent latency is tracked in self.send_latency. With batch set,
+    results that queued up while a send was in progress go out together as one encrypt_batch payload (only for
+    servers whose server_auth has decryptBatch). With framed set every connection opens with a newline, which tells
+    the server's StreamDecoder to expect framing, and every payload ends in one so the server can split a stream of
+    them; base64 decoding ignores newlines, so older servers still read single messages.
+    """
+    def __init__(self, target_ip, target_port, key, max_backoff=8.0, legacy_padding=True, batch=False, framed=True):
         self.key = key
-        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        self.session = EncryptionSession(key, legacy_padding)
+        self.batch = batch
+        self.framed = framed
+        self.target_ip = target_ip
+        self.max_backoff = max_backoff
+        self.sock = None
+        self.outbox = queue.Queue()
+        self.reconnects = 0  # Connections made after an earlier one was lost
+        self.has_connected = False
+        self.announce_framing = False  # The framing marker is still to be sent on this connection
+        self.send_latency = LatencyCounter()
+        self.closed = threading.Event()
         try:
-            logging.info("Attempting to connect to evaluation server ...")
-            self.sock.connect((target_ip, int(target_port)))
-        except OSError as e1:
-            logging.debug("An error occurred, system exiting")
-            logging.debug("Attempted to connect to: " + target_ip + "(" + target_port + ")" + '\n' + str(e1))
-            logging.debug(repr(e1))
-            sys.exit()
+            self.target_port = int(target_port)
         except ValueError as e2:
             logging.debug("An error occurred, system exiting")
             logging.debug("Attempted to connect to: " + target_ip + "(" + target_port + ")" + '\n' + str(e2))
             logging.debug(repr(e2))
             sys.exit()
-        else:
-            logging.info("Successfully connected to:" + target_ip + "(" + target_port + ")")
+        logging.info("Attempting to connect to evaluation server ...")
+        if not self.connect():
+            logging.info("Evaluation server unreachable; will keep retrying in the background")
+        self.sender_thread = threading.Thread(target=self.send_loop, daemon=True)
+        self.sender_thread.start()
+
+    def connect(self):
+        try:
+            self.sock = socket.create_connection((self.target_ip, self.target_port), timeout=5.0)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Results are tiny, do not batch them
+            self.sock.settimeout(None)
+        except OSError as e1:
+            logging.debug("Attempted to connect to: " + self.target_ip + "(" + str(self.target_port) + ")" + '\n'
+                          + str(e1))
+            self.sock = None
+            return False
+        logging.info("Successfully connected to:" + self.target_ip + "(" + str(self.target_port) + ")")
+        if self.has_connected:
+            self.reconnects += 1
+        self.has_connected = True
+        self.announce_framing = self.framed
+        return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def peer_closed(self):
+        # The server never writes to us, so a readable socket means it has gone (a write alone would not fail)
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        return len(readable) > 0 and self.sock.recv(1, socket.MSG_PEEK) == b''
 
     def send_message(self, message):
-        # No error detection/handling implemented for now
-        self.sock.sendall(encode_encrypt_message(message, self.key))
+        """Queues message for delivery and returns immediately"""
+        self.outbox.put((message, time.perf_counter()))
+
+    def send_loop(self):
+        backoff = 0.25
+        while not self.closed.is_set():
+            try:
+                messages = [self.outbox.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while self.batch and not self.outbox.empty():
+                messages.append(self.outbox.get())
+            with instrumentation.span("encrypt"):
+                payload = self.session.encrypt_batch([message for message, _ in messages])
+            if self.framed:
+                payload += b'\n'
+            while not self.closed.is_set():
+                if self.sock is None:
+                    if not self.connect():
+                        self.closed.wait(backoff)
+                        backoff = min(backoff * 2.0, self.max_backoff)
+                        continue
+                try:
+                    if self.peer_closed():
+                        raise ConnectionResetError("evaluation server closed the connection")
+                    with instrumentation.span("send"):
+                        # The marker goes out in the same sendall, so a server never sees it after a partial payload
+                        self.sock.sendall(b'\n' + payload if self.announce_framing else payload)
+                    self.announce_framing = False
+                except OSError as e1:
+                    logging.info("Lost connection to evaluation server, reconnecting: " + repr(e1))
+                    self.disconnect()
+                    continue
+                backoff = 0.25
+                for _, queued_time in messages:
+                    self.send_latency.add(time.perf_counter() - queued_time)
+                break
+            for _ in messages:
+                self.outbox.task_done()
+
+    def flush(self, timeout=None):
+        """Blocks until every queued message has been sent, or for at most timeout seconds; returns whether the
+        outbox was emptied"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.outbox.all_tasks_done:
+            while self.outbox.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.outbox.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self):
+        self.closed.set()
+        self.sender_thread.join()
+        self.disconnect()
+
+
+class LatencyCounter:
+    """Running count / mean / max of durations in seconds, cheap enough to update on every event"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+        self.last = duration
+
+    def report(self):
+        mean = self.total / self.count if self.count > 0 else 0.0
+        return "n:{} mean:{:.3f}ms max:{:.3f}ms last:{:.3f}ms".format(self.count, mean * 1000.0, self.maximum * 1000.0,
+                                                                       self.last * 1000.0)
 
 
 # Enums
@@ -158,6 +520,14 @@ class MessageType(Enum):
     POWER = "P"
 
 
+# Binary framing: sync(2) | type(1) | sequence number(uint16) | readings(int16 x n, value * 100) | CRC-16/CCITT(2)
+# CRC covers type to last reading, all fields little endian. Movement frames are 31 bytes, power frames 11 bytes.
+BINARY_SYNC = b'\xaa\x55'
+BINARY_SCALE = 100.0
+BINARY_INT16_RANGE = (-32768, 32767)  # So readings are limited to -327.68 ... 327.67
+BINARY_READING_COUNT = {b'M': 12, b'P': 2}
+
+
 class GeneralMessageIndex(Enum):
     MESSAGE_NUMBER = 0
     MESSAGE_TYPE = 1
@@ -189,6 +559,7 @@ class InteractiveModeIndex(Enum):
     SERVER_COMMS = "1"
     MEGA_COMMS = "2"
     TRAINING_SOLO = "3"
+    BINARY_LOOPBACK = "4"
 
 
 class Message:
@@ -259,9 +630,9 @@ class MessageParser:
             logging.debug("Incorrect number of elements error (power message)")
             return False
 
-        # Checksum validation
-        end_index = len(message_string) - 5 if message_string[len(message_string) - 5] == ',' \
-            else len(message_string) - 4
+        # Checksum validation: XOR of every character from '[' up to, not including, the comma before the checksum
+        # (as the Mega computes it and encode() reproduces it, whether the checksum has 1, 2 or 3 digits)
+        end_index = message_string.rfind(',')
         for i, c in enumerate(message_string[0:end_index]):  # checksum itself removed from the string
             checksum = ord(c) if i == 0 else (checksum ^ ord(c))
         message_arr = message_string[0:len(message_string)-2].split(',')
@@ -271,16 +642,169 @@ class MessageParser:
             return False
         return True
 
+    @staticmethod
+    def parse_into(message_bytes, out):
+        """Bytes-level fast path for one raw message "[SN,T,...,CS]", leading/trailing bytes are ignored.
+
+        Framing and checksum are checked in one pass without decoding, with the same rules as validity_check: the
+        message must end in ']' (a trailing '\r' aside) and the checksum covers '[' up to the comma before it.
+        Movement readings are written straight into out (a numpy row of 12), power readings are returned as a
+        list. Returns (message type, power readings or None), or (None, None) if the message is invalid.
+        """
+        message_bytes = message_bytes.rstrip(b'\r')
+        view = memoryview(message_bytes)
+        start = message_bytes.find(b'[')
+        end = len(message_bytes) - 1
+        if start < 0 or end < 0 or message_bytes[end] != ord(']'):
+            return None, None
+        checksum_separator = message_bytes.rfind(b',', start, end)
+        if checksum_separator < start:
+            return None, None
+
+        checksum = numpy.bitwise_xor.reduce(numpy.frombuffer(view[start:checksum_separator], dtype=numpy.uint8))
+        fields = view[start + 1:end].tobytes().split(b',')
+        try:
+            if checksum != int(fields[-1]):
+                return None, None
+            if fields[GeneralMessageIndex.MESSAGE_TYPE.value] == b'M' and len(fields) == 15:
+                out[:] = fields[2:14]
+                numpy.round(out, 2, out=out)
+                return MessageType.MOVEMENT, None
+            elif fields[GeneralMessageIndex.MESSAGE_TYPE.value] == b'P' and len(fields) == 5:
+                return MessageType.POWER, [float(fields[2]), float(fields[3])]
+        except ValueError:
+            pass
+        return None, None
+
+    @staticmethod
+    def parse_chunk(chunk, out):
+        """Parses every complete (newline-terminated) message in a raw chunk read off the port.
+
+        Movement readings fill consecutive rows of out, stopping early if out is full. Returns (rows written,
+        latest power readings or None, invalid message count, unconsumed bytes to prepend to the next chunk).
+        """
+        rows = 0
+        power_readings = None
+        invalid = 0
+        position = 0
+        while rows < len(out):
+            line_end = chunk.find(b'\n', position)
+            if line_end < 0:
+                break
+            message_type, readings = MessageParser.parse_into(chunk[position:line_end], out[rows])
+            if message_type == MessageType.MOVEMENT:
+                rows += 1
+            elif message_type == MessageType.POWER:
+                power_readings = readings
+            else:
+                invalid += 1
+            position = line_end + 1
+        return rows, power_readings, invalid, chunk[position:]
+
+    @staticmethod
+    def encode(serial_number, message_type, readings):
+        """Builds one ASCII message as the Mega sends it, including the leading 0x00 and trailing newline"""
+        body = '[' + str(serial_number) + ',' + message_type.value + ',' + ','.join('%.2f' % i for i in readings)
+        checksum = 0
+        for c in body:
+            checksum ^= ord(c)
+        return ('\x00' + body + ',' + str(checksum) + ']\n').encode()
+
+    @staticmethod
+    def encode_binary(message_type, sequence_number, readings):
+        """Builds one binary frame, as the Mega sends them in binary mode. Readings are sent as int16 * 100, so values
+        beyond -327.68 ... 327.67 are clamped to that range (a saturated sensor) rather than failing the pack"""
+        low, high = BINARY_INT16_RANGE
+        body = struct.pack('<cH%dh' % len(readings), message_type.value.encode(), sequence_number & 0xFFFF,
+                           *[min(max(int(round(reading * BINARY_SCALE)), low), high) for reading in readings])
+        return BINARY_SYNC + body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+
+    @staticmethod
+    def parse_binary_chunk(chunk, out):
+        """Binary mode counterpart of parse_chunk, with the same return values"""
+        rows = 0
+        power_readings = None
+        invalid = 0
+        position = 0
+        view = memoryview(chunk)
+        while rows < len(out):
+            start = chunk.find(BINARY_SYNC, position)
+            if start < 0:
+                position = len(chunk) - 1 if chunk.endswith(BINARY_SYNC[:1]) else len(chunk)  # Keep half a sync
+                break
+            if start > position:
+                invalid += 1  # Skipped bytes that were not a frame
+            if start + 3 > len(chunk):
+                position = start
+                break
+            reading_count = BINARY_READING_COUNT.get(chunk[start + 2:start + 3])
+            if reading_count is None:
+                invalid += 1
+                position = start + 1
+                continue
+            frame_end = start + 7 + 2 * reading_count
+            if frame_end > len(chunk):
+                position = start
+                break
+            if struct.unpack_from('<H', chunk, frame_end - 2)[0] != binascii.crc_hqx(view[start + 2:frame_end - 2], 0xFFFF):
+                invalid += 1
+                position = start + 1
+                continue
+
+            readings = numpy.frombuffer(chunk, dtype='<i2', count=reading_count, offset=start + 5)
+            if reading_count == 12:
+                numpy.divide(readings, BINARY_SCALE, out=out[rows])
+                rows += 1
+            else:
+                power_readings = (readings / BINARY_SCALE).tolist()
+            position = frame_end
+        return rows, power_readings, invalid, chunk[position:]
+
+
+class EncryptionSession:
+    """AES-CBC encryption for one key, with IVs drawn from a pooled urandom buffer rather than one read each.
+
+    legacy_padding pads with "0" characters as the original client did; otherwise PKCS#7 is used. Both decrypt
+    fine with server_auth, old or new.
+    """
+    def __init__(self, key, legacy_padding=True, iv_pool_size=256):
+        self.key = key.encode()
+        self.legacy_padding = legacy_padding
+        self.iv_pool_size = iv_pool_size
+        self.iv_pool = b''
+        self.iv_position = 0
+
+    def next_iv(self):
+        if self.iv_position >= len(self.iv_pool):
+            self.iv_pool = os.urandom(AES.block_size * self.iv_pool_size)
+            self.iv_position = 0
+        iv = self.iv_pool[self.iv_position:self.iv_position + AES.block_size]
+        self.iv_position += AES.block_size
+        return iv
+
+    def pad(self, data):
+        bytes_for_padding = AES.block_size - (len(data) % AES.block_size)
+        return data + (b'0' if self.legacy_padding else bytes([bytes_for_padding])) * bytes_for_padding
+
+    def encrypt(self, message):
+        """Pads message to nearest multiple of 16 bytes, encrypt with AES, then encoded in base64"""
+        padded_msg = self.pad(message.encode())
+        iv = self.next_iv()
+        return base64.b64encode(iv + AES.new(self.key, AES.MODE_CBC, iv).encrypt(padded_msg))
+
+    def encrypt_batch(self, messages):
+        """Encrypts several formatted results ('#...|' each) as one payload, split again by decryptBatch"""
+        return self.encrypt(''.join(messages))
+
+
+encryption_sessions = {}  # Key -> EncryptionSession used by encode_encrypt_message
+
 
 def encode_encrypt_message(message, key):
     """Pads message to nearest multiple of 16 bytes, encrypt with AES, then encoded in base64"""
-    bytes_for_padding = 16 - (len(message) % 16)
-    padding_str = "0" * bytes_for_padding
-    padded_msg = (message + padding_str).encode()
-    iv = Random.new().read(AES.block_size)
-    cipher = AES.new(key.encode(), AES.MODE_CBC, iv)
-    msg = base64.b64encode(iv + cipher.encrypt(padded_msg))
-    return msg
+    if key not in encryption_sessions:
+        encryption_sessions[key] = EncryptionSession(key)
+    return encryption_sessions[key].encrypt(message)
 
 
 def format_results(action, voltage, current, power, cumulative_power):
@@ -289,26 +813,102 @@ def format_results(action, voltage, current, power, cumulative_power):
 
 
 def fetch_script_arguments():
-    """Fetches command line arguments, all are required"""
+    """Fetches command line arguments, -i -p -k -b -l are required"""
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--target_ip', help="Target Server IP Address", required=True)
     parser.add_argument('-p', '--target_port', help="Target Server TCP port number", required=True)
     parser.add_argument('-k', '--key', help="16 / 24 / 32 character key", required=True)
     parser.add_argument('-b', '--baud_rate', help="Serial Baud Rate (4800/9600/14400/19200/28800/38400/57600/115200)"
                         , required=True)
-    parser.add_argument('-l', '--logging_mode', help="Enables debug printing (debug/none)", required=True)
+    parser.add_argument('-l', '--logging_mode', help="Enables info / debug printing (info/debug/none)", required=True)
+    parser.add_argument('--log_every', help="Log one in this many per-sample messages", type=int, default=20)
+    parser.add_argument('--trace', help="Record raw readings and predictions to this rotating binary trace file "
+                                        "(replay with replay.py --trace)")
+    parser.add_argument('--trace_mb', help="Trace file size before it is rotated", type=float, default=16.0)
+    parser.add_argument('-w', '--binary', help="Offer binary framing to the Mega during handshake (evaluation mode)",
+                        action='store_true')
+    parser.add_argument('-d', '--decision', help="Move decision engine", choices=sorted(DECISION_ENGINES),
+                        default='consecutive')
+    parser.add_argument('-t', '--threshold', help="Confidence threshold for the ema / sprt decision engines", type=float)
+    parser.add_argument('-m', '--max_frames', help="Most frames the ema / sprt decision engines wait for", type=int)
+    parser.add_argument('--pkcs7', help="Pad results with PKCS#7 instead of '0' characters", action='store_true')
+    parser.add_argument('--batch_results', help="Send queued-up results as one payload (server needs decryptBatch)",
+                        action='store_true')
+    parser.add_argument('--unframed', help="Send results without the newline delimiter (legacy servers)",
+                        action='store_true')
+    parser.add_argument('--instrument', help="Time hot paths into latency histograms, logged with the stage report "
+                                             "and printed on SIGUSR1", action='store_true')
+    parser.add_argument('--import_report', help="Print how long each deferred import took, at startup and exit",
+                        action='store_true')
+    parser.add_argument('-j', '--stage_processes', help="Worker processes per pipeline stage, e.g. features=2 classifier=1",
+                        nargs='*', default=[])
     return parser.parse_args()
 
 
+def binary_loopback_test(readings_count=500):
+    """Runs a fake Mega speaking binary framing on a pty pair (in place of /dev/ttyAMA0) through RpiMegaClient.
+    Returns whether every reading and the trailing power reading arrived intact (python loopback_test.py runs it
+    unattended)"""
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    expected = numpy.round(numpy.random.uniform(-300.0, 300.0, (readings_count, 12)), 2)
+
+    def fake_mega():
+        received = b''
+        while b'HB\n' not in received:
+            received += os.read(master, 64)
+        os.write(master, b'AB\n')
+        while b'S\n' not in received:
+            received += os.read(master, 64)
+        frames = b''.join(MessageParser.encode_binary(MessageType.MOVEMENT, i, reading)
+                          for i, reading in enumerate(expected))
+        frames += MessageParser.encode_binary(MessageType.POWER, readings_count, [5.02, 1.37])
+        view = memoryview(frames)
+        while len(view) > 0:
+            view = view[os.write(master, view):]
+
+    mega_thread = threading.Thread(target=fake_mega, daemon=True)
+    mega_thread.start()
+    mega_client = RpiMegaClient(os.ttyname(slave), binary=True)
+    mega_client.three_way_handshake()
+    mega_client.start_reader(capacity=readings_count)
+    mega_client.send_message("S")
+
+    received = []
+    received_count = 0
+    while received_count < readings_count:
+        readings = mega_client.readings.get(readings_count - received_count, timeout=5.0)
+        if len(readings) == 0:
+            break
+        received.append(readings)
+        received_count += len(readings)
+    mega_thread.join(timeout=5.0)
+    deadline = time.monotonic() + 5.0
+    while mega_client.power_readings != [5.02, 1.37] and time.monotonic() < deadline:
+        time.sleep(0.01)  # The trailing power frame is parsed after the last movement frame
+    mega_client.stop_reader()
+    os.close(master)
+    os.close(slave)
+
+    passed = mega_client.binary_mode and received_count == readings_count \
+        and numpy.array_equal(numpy.concatenate(received), expected) and mega_client.power_readings == [5.02, 1.37]
+    print("Binary loopback:", "passed" if passed else "FAILED", "-", received_count, "/", readings_count,
+          "readings, parse errors:", mega_client.parse_errors, ", dropped:", mega_client.readings.dropped)
+    return passed
+
+
 def interactive_mode(args):
     """Interactive mode intended for convenient testing"""
     while True:
-        print("Component to test: (1)Comms to server, (2)Comms to arduino (3)Training - solo")
+        print("Component to test: (1)Comms to server, (2)Comms to arduino (3)Training - solo (4)Binary framing loopback")
         mode = input()
 
         # Socket communication to Server
         if mode == InteractiveModeIndex.SERVER_COMMS.value:
-            server_client = RpiEvalServerClient(args.target_ip, args.target_port, args.key)
+            server_client = RpiEvalServerClient(args.target_ip, args.target_port, args.key, legacy_padding=not args.pkcs7,
+                                            batch=args.batch_results, framed=not args.unframed)
             print("Relay password to sever:", server_client.key, ", and wait for move prompt on GUI")
             while True:
                 print("Enter input: action voltage current power cumulative_power // or E to exit")
@@ -322,7 +922,7 @@ def interactive_mode(args):
         elif mode == InteractiveModeIndex.MEGA_COMMS.value:
             global frame_length
             global sampling_interval
-            mega_client = RpiMegaClient(baudrate=args.baud_rate)
+            mega_client = RpiMegaClient(baudrate=args.baud_rate)  # Reads line by line: ASCII framing only
             while True:
                 print("Functionality to test: (1)Send one message, (2)Repeat read-print for 5 seconds, \
                         (3)Three way handshake," "(4)Speed test (E)Exit")
@@ -351,36 +951,46 @@ def interactive_mode(args):
                     input()
                     mega_client.three_way_handshake()
 
-                # Speed Test
+                # Speed Test -- loads only serial (numpy, scipy, sklearn stay deferred), so no import lands in the timings
                 elif mode == "4":
                     mega_client.three_way_handshake()
                     iteration = 1
                     buffer = []
                     timings = []
+                    message_timings = instrumentation.LatencyHistogram()
                     mega_client.send_message("S")
                     print("S sent to mega")
                     while iteration < 4:
                         mega_client.port.reset_input_buffer()
                         mega_client.discard_till_sentinel()
 
-                        start_time = int(time.time())
+                        start_time = time.perf_counter_ns()
                         while len(buffer) != 50:
+                            message_start_time = time.perf_counter_ns()
                             buffer.append(MessageParser.parse(mega_client.read_message()))
-                        end_time = int(time.time())
+                            message_timings.record(time.perf_counter_ns() - message_start_time)
+                        end_time = time.perf_counter_ns()
                         timings.append(end_time-start_time)
                         iteration += 1
                         buffer.clear()
-                    time_for_150 = round(float(timings[0] + timings[1] + timings[2])/150.0, 6)
+                    time_for_150 = round(float(timings[0] + timings[1] + timings[2])/150.0/1e9, 6)
                     print("Average time taken to process a data point:", time_for_150, " seconds")
                     print("Data points per second:", round(1.0/time_for_150, 2))
+                    print("Per data point - p50: {:.3f}ms, p95: {:.3f}ms, p99: {:.3f}ms, max: {:.3f}ms".format(
+                        message_timings.percentile(50) / 1e6, message_timings.percentile(95) / 1e6,
+                        message_timings.percentile(99) / 1e6, message_timings.maximum / 1e6))
                     print("Exiting speed test")
                 # Exit
                 elif mode == "E":
                     break
 
+        # Binary framing loopback over a pty pair, no Mega required
+        elif mode == InteractiveModeIndex.BINARY_LOOPBACK.value:
+            binary_loopback_test()
+
         # Solo move training mode -- one move at a time
         elif mode == InteractiveModeIndex.TRAINING_SOLO.value:
-            mega_client = RpiMegaClient(baudrate=args.baud_rate)
+            mega_client = RpiMegaClient(baudrate=args.baud_rate)  # Reads line by line: ASCII framing only
             mega_client.three_way_handshake()
 
             print("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@")
@@ -418,13 +1028,15 @@ def interactive_mode(args):
             # Persistence setup
             current_date = datetime.date.today()
             time_str = str(int(time.time()))
-            data_buffer = [] # List of data points
-            training_data = [] # List of frames
+            frame_buffer = FrameRingBuffer(frame_length, int(frame_length*(1-overlap_ratio)))  # Data points
+            sample_log = telemetry.sampled(every=args.log_every)  # One readings log line per log_every messages
+            training_data = numpy.zeros((50, frame_length, 12))  # Frames of the current chunk
+            frame_count = 0
             session_chunk_number = 0
 
             try:
                 while True:
-                    while len(data_buffer) < frame_length:
+                    while frame_buffer.pending() > 0:
                         if sampling_interval > 0:
                             time.sleep(sampling_interval)
                             mega_client.port.reset_input_buffer()
@@ -434,25 +1046,25 @@ def interactive_mode(args):
                         except ValueError:
                             print("message validity error; ignored")
                             continue  # if message error, ignore
-                        logging.info("m:" + message.serial_number + "(" + message.type.value + ")=" + str(message.readings))
+                        sample_log.log("m:%s(%s)=%s", message.serial_number, message.type.value, message.readings)
                         # Add readings set to buffer
                         if message.type == MessageType.MOVEMENT:
-                            data_buffer.append(message.readings)
+                            frame_buffer.append(message.readings)
                         else:
                             pass  # No need for power values
-                    training_data.append(data_buffer.copy())
-                    data_buffer = data_buffer[int(frame_length*(1-overlap_ratio)):]  # Partial buffer flush
+                    training_data[frame_count] = frame_buffer.next_frame()  # Overlap is kept by the ring buffer
+                    frame_count += 1
 
                     # Autosave
-                    if len(training_data) == 50:
-                        temp_arr = numpy.array(training_data.copy())
+                    if frame_count == len(training_data):
+                        temp_arr = training_data
                         timestamp = str(current_date.day) + "-" + str(current_date.month) + "-" + str(current_date.year)[2:]\
                             + "-" + time_str[5:]
                         temp_file_name = "training_data/" + timestamp + "_" + Move(input_move_number).name\
                             + "L" + str(frame_length) + "SI" + str(input_sampling_interval) + "R" + str(overlap_ratio)\
                             + "(" + str(session_chunk_number) + ")"
                         numpy.save(temp_file_name, temp_arr)
-                        training_data.clear()
+                        frame_count = 0
                         session_chunk_number += 1
                         print("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@")
                         print("File generated:", temp_file_name)
@@ -470,7 +1082,7 @@ def interactive_mode(args):
 
             except KeyboardInterrupt:
                 print("Session manually interrupted")
-                temp_arr = numpy.array(training_data.copy())
+                temp_arr = training_data[:frame_count]
                 timestamp = str(current_date.day) + "-" + str(current_date.month) + "-" + str(current_date.year)[2:]\
                         + "-" + time_str[5:]
                 temp_file_name = "training_data/" + timestamp + "_" + Move(input_move_number).name\
@@ -482,14 +1094,189 @@ def interactive_mode(args):
                 sys.exit(0)
 
 
-def evaluation_mode(mega_client, server_client, ml_client):
-    # Loop Vars
-    temp_cumulative_power = 0.0
-    #evaluation_start_time = int(time.time())
-    global evaluation_start_time
-    number_results_sent = 0
+class MoveState:
+    """Shared by the frame assembler and the result voter: which move incoming frames belong to"""
+    def __init__(self):
+        self.move_id = 0
+        self.move_start_time = int(time.time())  # 1-second precision of seconds since epoch
+
+    def next_move(self):
+        self.move_id += 1
+        self.move_start_time = int(time.time())
+
+
+class FrameAssembler:
+    """Pipeline source: pulls readings off the Mega reader thread and emits (move id, frame) every frame hop.
+
+    With incremental set, readings are also pushed into a SlidingFeatureWindow and (move id, feature row) is
+    emitted instead, so the per-frame cost does not grow with the overlap (only valid for the default features).
+    """
+    def __init__(self, mega_client, move_state, incremental=False):
+        self.mega_client = mega_client
+        self.move_state = move_state
+        # Overlapping frames are views into the ring; one frame hop of new readings is needed between them
+        self.frame_buffer = FrameRingBuffer(frame_length, int(frame_length*(1-overlap_ratio)))
+        self.feature_window = SlidingWindow.SlidingFeatureWindow(frame_length) if incremental else None
+        self.move_id = None
+
+    def __call__(self):
+        if self.mega_client.consecutive_parse_errors >= 3:
+            logging.info("Message validity check failed three times in a row. Buffer flushed.")
+            self.mega_client.stop_reader()
+            self.mega_client.three_way_handshake()
+            logging.info("Sleeping for 5 seconds")
+            time.sleep(5)
+            self.mega_client.start_reader()
+            self.mega_client.send_message("S")
+            logging.info("S sent")
+            self.move_id = None
+
+        # New move; wait out the human reaction time, readings taken before then do not count
+        if self.move_id != self.move_state.move_id:
+            self.move_id = self.move_state.move_id
+            time.sleep(0.8)
+            self.mega_client.readings.flush()
+            self.frame_buffer.reset()
+            if self.feature_window is not None:
+                self.feature_window.reset()
+
+        readings = self.mega_client.readings.get(self.frame_buffer.pending(), timeout=0.5)
+        self.frame_buffer.extend(readings)
+        if self.feature_window is not None:
+            for reading in readings:
+                self.feature_window.push(reading)
+        frame = self.frame_buffer.next_frame()
+        if frame is None:
+            return None
+        if self.feature_window is not None:
+            return self.move_id, self.feature_window.features()  # The window holds exactly this frame's readings
+        return self.move_id, frame
+
+
+def extract_frame_features(item):
+    """Pipeline stage: (move id, frame) -> (move id, feature row), with the features the classifier expects"""
+    move_id, frame = item
+    return move_id, pipeline_ml_client.feature_bank.from_frame(frame)
+
+
+# Classifier used by extract_frame_features and classify_frame_features; set in every worker process by
+# install_ml_client
+pipeline_ml_client = None
+
+
+def install_ml_client(ml_client):
+    global pipeline_ml_client
+    pipeline_ml_client = ml_client
+
+
+def classify_frame_features(item):
+    """Pipeline stage: (move id, feature row) -> (move id, candidate action, class probabilities)"""
+    move_id, feature_frame = item
+    try:
+        return (move_id,) + pipeline_ml_client.classify_with_probabilities(feature_frame)
+    except ValueError:
+        logging.info("WARNING! ML Classifier has predicted an unknown class. This should not be possible.")
+        return None
+
+
+class ResultVoter:
+    """Pipeline sink: feeds each frame's probabilities to a decision engine, sends the result once it decides"""
+    def __init__(self, mega_client, server_client, move_state, classes, decision=None):
+        self.mega_client = mega_client
+        self.server_client = server_client
+        self.move_state = move_state
+        self.classes = classes  # Model class labels, in the order of the probability vectors
+        self.decision = decision if decision is not None else ConsecutiveMatchDecision()
+        self.frames_for_move = 0
+        self.cumulative_power = 0.0
+        self.number_results_sent = 0
+        self.performance_start_time = time.perf_counter()
+
+    def __call__(self, item):
+        move_id, candidate_action, probabilities = item
+        if move_id != self.move_state.move_id:
+            return None  # Frame belongs to a move that has already been decided
+        print("Frame completed. Generated candidate:" + candidate_action)
+        if telemetry.trace_writer is not None:
+            telemetry.trace(telemetry.PREDICTION, [numpy.concatenate(([move_id], probabilities))])
+        self.frames_for_move += 1
+        decided = self.decision.update(probabilities)
+        if decided is None:
+            logging.info("Not confident yet after %d frame(s)", self.frames_for_move)
+            return None
+        try:
+            action = RpiMLClient.action_name(self.classes[decided])
+        except ValueError:
+            logging.info("WARNING! Decision engine settled on an unknown class. This should not be possible.")
+            self.decision.reset()
+            return None
+
+        # Power calculations TODO: Mechanism to detect if power readings have been read ornot
+        move_end_time = int(time.time())
+        move_time_elapsed = move_end_time - self.move_state.move_start_time
+        total_time_elapsed = move_end_time - evaluation_start_time
+        move_power_readings = self.mega_client.power_readings
+        temp_voltage = move_power_readings[0]  # Send as Volts, 2.d.p from Mega
+        temp_current = move_power_readings[1]  # Send as Amperes, 2.d.p from Mega
+        temp_current_power = temp_voltage * temp_current  # Send as Watts
+
+        # Calculated as watt-hours with max precision
+        self.cumulative_power = (temp_current_power * total_time_elapsed)/3600.0 \
+            if self.cumulative_power == 0.0 \
+            else self.cumulative_power + (temp_current_power * move_time_elapsed)/3600.0
+
+        # Sending result
+        result_string = format_results(action=action,
+                                       voltage=round(temp_voltage, 4), current=round(temp_current, 4),
+                                       power=round(temp_current_power, 4),
+                                       cumulative_power=round(self.cumulative_power, 4))
+        self.server_client.send_message(result_string)
+        self.decision.reset()
+        self.move_state.next_move()
+        logging.info("Prediction accepted after %d frame(s)", self.frames_for_move)
+        self.frames_for_move = 0
+        logging.info("Result sent to server: %s", result_string)
+        self.number_results_sent += 1
+        print(self.number_results_sent, "results sent - avg time taken:",
+              round((time.perf_counter() - self.performance_start_time) / self.number_results_sent, 3), "seconds")
+        return result_string
+
+
+def build_evaluation_pipeline(mega_client, server_client, ml_client, stage_processes=None, decision=None):
+    """Reader -> frame assembler -> features -> classifier -> voter; call start() once the Mega is streaming.
+
+    The reader is the Mega client's own thread; every other stage runs on its own thread connected by bounded
+    queues, so frame N+1 is collected while frame N is classified. stage_processes maps "features" and/or
+    "classifier" to a number of worker processes for that stage. decision is the engine that accepts a move
+    (default: 2 consecutive matching candidates).
+
+    When the model uses the default features and the features stage would run in-thread, the assembler keeps
+    them up to date incrementally (SlidingFeatureWindow) and the features stage is left out.
+    """
+    stage_processes = stage_processes or {}
+    install_ml_client(ml_client)
+    move_state = MoveState()
+    incremental = stage_processes.get("features", 0) == 0 \
+        and tuple(ml_client.feature_bank.groups) == FeatureExtractor.DEFAULT_FEATURE_GROUPS
+    stages = [Stage("assembler", FrameAssembler(mega_client, move_state, incremental))]
+    if not incremental:
+        stages.append(Stage("features", extract_frame_features, processes=stage_processes.get("features", 0),
+                            initializer=install_ml_client, initargs=(ml_client,)))
+    stages += [
+        Stage("classifier", classify_frame_features, processes=stage_processes.get("classifier", 0),
+              initializer=install_ml_client, initargs=(ml_client,)),
+        Stage("voter", ResultVoter(mega_client, server_client, move_state, ml_client.compiled_model.classes, decision)),
+    ]
+    return Pipeline(stages)
+
+
+def evaluation_mode(mega_client, server_client, ml_client, stage_processes=None, decision=None, report_interval=30,
+                    flush_timeout=10.0):
+    """Runs the evaluation pipeline (see build_evaluation_pipeline) until interrupted, logging stage counters
+    every report_interval seconds. Results still queued at the end get up to flush_timeout seconds to go out."""
     # (Blocking)Initial Handshake
     mega_client.three_way_handshake()
+    mega_client.start_reader()
 
     # Pause; Wait for server to present challenge move
     print("Wait for server to prompt the first challenge move, then press any key to begin.")
@@ -499,111 +1286,39 @@ def evaluation_mode(mega_client, server_client, ml_client):
     mega_client.send_message("S")
     logging.info("S sent")
 
-    performance_start_time = int(time.time())
-
-    # Generate unlimited predictions
-    while True:
-        move_start_time = int(time.time())  # 1-second precision of seconds since epoch
-        time.sleep(0.8)  # human reaction time
-        mega_client.port.reset_input_buffer()  # flush input
-        mega_client.discard_till_sentinel()  # flush is likely to cut off a message
-
-        # Per result loop vars
-        error_count = 0
-        candidates = []
-        data_buffer = []
-
-        # Per prediction loop -- 3 predictions for 1 result
-        while len(candidates) < 2:
-            # Fill frame
-            while len(data_buffer) < frame_length:
-                try:
-                    #time.sleep(sampling_interval)
-                    #mega_client.port.reset_input_buffer()  # flush input
-                    #mega_client.discard_till_sentinel()  # flush is likely to cut off a message
-                    message = MessageParser.parse(mega_client.read_message())
-                except ValueError as err:
-                    error_count += 1
-                    if error_count == 3:
-                        error_count = 0
-                        data_buffer.clear()
-                        logging.info(repr(err))
-                        logging.info("Message validity check failed three times in a row. Buffer flushed.")
-                        mega_client.three_way_handshake()
-                        logging.info("Sleeping for 5 seconds")
-                        time.sleep(5)
-                        mega_client.send_message("S")
-                        logging.info("S sent")
-                else:
-                    error_count = 0
-                    # Acknowledge the message
-                    #mega_client.send_message("A," + message.serial_number + "\n")  # TODO reinstate ACK
-
-                    logging.info("m:" + message.serial_number + "(" + message.type.value + ")=" + str(message.readings))
-                    # Add readings set to buffer
-                    if message.type == MessageType.MOVEMENT:
-                        data_buffer.append(message.readings)
-                    else:
-                        move_power_readings = message.readings  # We only store 1 power reading set per move
-
-            # Frame full; Generate candidate prediction from frame data
-            try:
-                candidate_action = ml_client.classify(data_buffer)
-            except ValueError as err:
-                logging.info("WARNING! ML Classifier has predicted an unknown class. This should not be possible.")
-                logging.info("Emptying buffer")
-                data_buffer.clear()
-                continue  # Refill frame
-            else:
-                print("Frame completed. Generated candidate:" + candidate_action)
-                #logging.info("Frame completed. Generated candidate:" + candidate_action)
-                candidates.append(candidate_action)
-
-            # Partial clear of frame buffer based on overlap
-            data_buffer = data_buffer[int(frame_length*(1-overlap_ratio)):]
-
-            if len(candidates) == 2:
-                # Match predictions
-                match = candidates[0] == candidates[1]
-
-                # Check for consecutive 2
-                if match:
-                    # Power calculations TODO: Mechanism to detect if power readings have been read ornot
-                    move_end_time = int(time.time())
-                    move_time_elapsed = move_end_time - move_start_time
-                    total_time_elapsed = move_end_time - evaluation_start_time
-                    temp_voltage = move_power_readings[0]  # Send as Volts, 2.d.p from Mega
-                    temp_current = move_power_readings[1]  # Send as Amperes, 2.d.p from Mega
-                    temp_current_power = temp_voltage * temp_current  # Send as Watts
-
-                    # Calculated as watt-hours with max precision
-                    temp_cumulative_power = (temp_current_power * total_time_elapsed)/3600.0 \
-                        if temp_cumulative_power == 0.0 \
-                        else temp_cumulative_power + (temp_current_power * move_time_elapsed)/3600.0
-
-                    # Sending result
-                    result_string = format_results(action=candidates[0],
-                                                   voltage=round(temp_voltage, 4), current=round(temp_current, 4),
-                                                   power=round(temp_current_power,4),
-                                                   cumulative_power=round(temp_cumulative_power, 4))
-                    server_client.send_message(result_string)
-                    move_power_readings = []  # Clear power readings
-                    logging.info("Prediction accepted. Matched candidates >= 2/3")
-                    logging.info("Result sent to server: " + result_string)
-                    number_results_sent += 1
-                    print(number_results_sent, "results sent - avg time taken:", float(int(time.time())-performance_start_time)/number_results_sent, "seconds")
-
-                # Unacceptable results, all 3 candidates differ; dump the first 2
-                else:
-                    candidates = candidates[1:]
-                    logging.info("Prediction rejected. No consecutive match")
+    evaluation_pipeline = build_evaluation_pipeline(mega_client, server_client, ml_client, stage_processes, decision)
+    evaluation_pipeline.start()
+    try:
+        while evaluation_pipeline.is_running():
+            time.sleep(report_interval)
+            logging.info("Pipeline stages:\n" + evaluation_pipeline.report() + "\nReader - dropped: "
+                         + str(mega_client.readings.dropped) + ", parse errors: " + str(mega_client.parse_errors)
+                         + "\nServer sends - " + server_client.send_latency.report() + " queued:"
+                         + str(server_client.outbox.qsize()) + " reconnects:" + str(server_client.reconnects))
+            if instrumentation.enabled:
+                logging.info("Spans:\n" + instrumentation.report())
+    except KeyboardInterrupt:
+        print("Evaluation manually interrupted")
+    evaluation_pipeline.stop()
+    if not server_client.flush(flush_timeout):
+        print(server_client.outbox.unfinished_tasks, "result(s) could not be delivered to the evaluation server")
+    server_client.close()
+    print(evaluation_pipeline.report())
+    if instrumentation.enabled:
+        print(instrumentation.report())
 
 
 if __name__ == "__main__":
     args = fetch_script_arguments()
-    if args.logging_mode == "info":
-        logging.basicConfig(level=logging.INFO)
-    #logging.basicConfig(level=logging.DEBUG if args.logging_mode == "debug" else logging.INFO)
+    if args.logging_mode in ("info", "debug"):
+        telemetry.start_logging(logging.DEBUG if args.logging_mode == "debug" else logging.INFO)
+    if args.trace is not None:
+        telemetry.start_trace(args.trace, int(args.trace_mb * 1024 * 1024))
+    if args.instrument:
+        instrumentation.enable()
+        instrumentation.install_signal_handler()
+    if args.import_report:
+        atexit.register(lambda: print("Imports:\n" + import_report(startup_time)))
     mode = 0
 
     while mode != "1" and mode != "2":
@@ -614,7 +1329,12 @@ if __name__ == "__main__":
     if mode == "1":  # Interactive
         interactive_mode(args)
     elif mode == "2":  # Eval
-        server_client = RpiEvalServerClient(args.target_ip, args.target_port, args.key)
-        mega_client = RpiMegaClient(baudrate=args.baud_rate)
+        server_client = RpiEvalServerClient(args.target_ip, args.target_port, args.key, legacy_padding=not args.pkcs7,
+                                            batch=args.batch_results, framed=not args.unframed)
+        mega_client = RpiMegaClient(baudrate=args.baud_rate, binary=args.binary)
         ml_client = RpiMLClient("trained_models/trained_model_rf_full.sav")
-        evaluation_mode(mega_client, server_client, ml_client)
+        stage_processes = {name: int(count) for name, count in (pair.split("=") for pair in args.stage_processes)}
+        decision = make_decision_engine(args.decision, args.threshold, args.max_frames)
+        if args.import_report:
+            print("Imports before evaluation start:\n" + import_report(startup_time))
+        evaluation_mode(mega_client, server_client, ml_client, stage_processes, decision)
@@ -0,0 +1,224 @@
+"""Non-blocking telemetry for the sample loop: queue-backed logging, sampled per-sample logs and a binary trace.
+
+start_logging() routes every log record through a bounded queue to a listener thread, so a log call on the reader
+or pipeline threads is an enqueue; formatting and stderr writes happen on the listener. sampled() logs one call in
+every N, for messages that would otherwise fire at the sample rate. start_trace() records raw readings, power
+readings and per-frame predictions to a rotating binary file on a writer thread; replay.py --trace streams a trace
+back through the pipeline and python telemetry.py <trace> summarizes one.
+"""
+import argparse
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+from lazy_import import lazy_module
+
+numpy = lazy_module("numpy", globals())
+
+LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"  # As logging.basicConfig
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks or formats: records are queued as they are (args are formatted later, on the
+    listener thread, so do not pass arrays that are about to be overwritten) and dropped, counted, when full"""
+    def __init__(self, log_queue):
+        logging.handlers.QueueHandler.__init__(self, log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def start_logging(level=logging.INFO, stream=sys.stderr, capacity=10000):
+    """Replaces the root logger's handlers with a DroppingQueueHandler drained by a QueueListener writing to
+    stream; the listener is stopped (and the queue flushed) at exit. Returns the handler."""
+    log_queue = queue.Queue(capacity)
+    handler = DroppingQueueHandler(log_queue)
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler
+
+
+class SampledLogger:
+    """Logs only every `every`-th call; a skipped call costs a counter increment and no formatting"""
+    def __init__(self, logger=None, every=20, level=logging.INFO):
+        self.logger = logger or logging.getLogger()
+        self.every = max(1, every)
+        self.level = level
+        self.calls = 0
+
+    def log(self, message, *args):
+        self.calls += 1
+        if self.calls % self.every == 0 and self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, message, *args)
+
+
+def sampled(name=None, every=20, level=logging.INFO):
+    return SampledLogger(logging.getLogger(name), every, level)
+
+
+# Trace file: TRACE_MAGIC, uint32 format version, then records of a TRACE_RECORD header (kind, time.time(),
+# rows, columns) followed by rows x columns float32 values. Readings and power readings come off the Mega as 2 d.p.
+# values (int16 / 100 in binary framing), which float32 holds exactly enough to round back.
+TRACE_MAGIC = b"DRTRACE\0"
+TRACE_FORMAT_VERSION = 1
+TRACE_RECORD = struct.Struct("<cdHH")
+READINGS = b'R'  # (n, 12) movement readings, as the reader thread parsed them
+POWER = b'W'  # (1, 2) voltage, current
+PREDICTION = b'P'  # (1, 1 + classes) move id, then the class probabilities of one frame
+
+trace_writer = None  # Set by start_trace
+
+
+class TraceWriter(threading.Thread):
+    """Writes queued trace records to file_path, rotating it to file_path.1 ... file_path.<backups> (oldest)
+    once it grows past max_bytes. Records arriving while the queue is full are dropped and counted."""
+    def __init__(self, file_path, max_bytes=16 * 1024 * 1024, backups=3, capacity=4096):
+        threading.Thread.__init__(self, daemon=True)
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = queue.Queue(capacity)
+        self.dropped = 0
+        self.written = 0
+        self.file = None
+
+    def put(self, kind, rows):
+        """Queues rows (a 2D array, copied here so callers may reuse it) as one record; never blocks"""
+        rows = numpy.asarray(rows, dtype=numpy.float32)
+        try:
+            self.records.put_nowait(TRACE_RECORD.pack(kind, time.time(), rows.shape[0], rows.shape[1])
+                                    + rows.tobytes())
+        except queue.Full:
+            self.dropped += 1
+
+    def open(self):
+        self.file = open(self.file_path, 'wb')
+        self.file.write(TRACE_MAGIC + struct.pack("<I", TRACE_FORMAT_VERSION))
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.isfile(self.file_path + "." + str(index)):
+                os.replace(self.file_path + "." + str(index), self.file_path + "." + str(index + 1))
+        if self.backups > 0:
+            os.replace(self.file_path, self.file_path + ".1")
+        self.open()
+
+    def run(self):
+        self.open()
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            self.file.write(record)
+            self.written += 1
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+            elif self.records.empty():
+                self.file.flush()  # Caught up; let a crash lose as little as possible
+        self.file.close()
+
+    def close(self):
+        self.records.put(None)
+        self.join()
+
+
+def start_trace(file_path, max_bytes=16 * 1024 * 1024, backups=3):
+    global trace_writer
+    trace_writer = TraceWriter(file_path, max_bytes, backups)
+    trace_writer.start()
+    atexit.register(trace_writer.close)
+    return trace_writer
+
+
+def trace(kind, rows):
+    """Adds rows to the trace when one was started"""
+    if trace_writer is not None:
+        trace_writer.put(kind, rows)
+
+
+def trace_files(file_path):
+    """A trace and its rotated backups, oldest first"""
+    backups = []
+    index = 1
+    while os.path.isfile(file_path + "." + str(index)):
+        backups.append(file_path + "." + str(index))
+        index += 1
+    return backups[::-1] + ([file_path] if os.path.isfile(file_path) else [])
+
+
+def read_trace(file_path):
+    """Yields (kind, timestamp, rows) for every record of a trace and its rotated backups, in order"""
+    for path in trace_files(file_path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+            raise ValueError(path + " is not a trace file")
+        version, = struct.unpack_from("<I", data, len(TRACE_MAGIC))
+        if version != TRACE_FORMAT_VERSION:
+            raise ValueError(path + " has trace format version " + str(version) + ", expected "
+                             + str(TRACE_FORMAT_VERSION))
+        position = len(TRACE_MAGIC) + 4
+        while position + TRACE_RECORD.size <= len(data):
+            kind, timestamp, rows, columns = TRACE_RECORD.unpack_from(data, position)
+            position += TRACE_RECORD.size
+            if position + rows * columns * 4 > len(data):
+                break  # Cut off mid-record by a crash
+            values = numpy.frombuffer(data, numpy.float32, rows * columns, position).reshape(rows, columns)
+            position += rows * columns * 4
+            yield kind, timestamp, values
+
+
+def trace_readings(file_path):
+    """Every movement reading of a trace as an (n, 12) float64 array, rounded back to the Mega's 2 d.p."""
+    readings = [rows for kind, _, rows in read_trace(file_path) if kind == READINGS]
+    if not readings:
+        return numpy.zeros((0, 12))
+    return numpy.round(numpy.concatenate(readings).astype(numpy.float64), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarizes a telemetry trace (and its rotated backups)")
+    parser.add_argument('trace', help="Trace file written with rpi_client.py --trace")
+    parser.add_argument('-p', '--predictions', help="Also list every prediction record", action='store_true')
+    args = parser.parse_args()
+
+    counts = {}
+    first_time = last_time = None
+    for kind, timestamp, rows in read_trace(args.trace):
+        counts[kind] = counts.get(kind, 0) + len(rows)
+        first_time = timestamp if first_time is None else first_time
+        last_time = timestamp
+        if args.predictions and kind == PREDICTION:
+            print("{:.3f} move {:d} class index {:d} p={:.3f}".format(timestamp, int(rows[0, 0]),
+                                                                 int(numpy.argmax(rows[0, 1:])), rows[0, 1:].max()))
+    print("Files:", ", ".join(trace_files(args.trace)))
+    if first_time is not None:
+        print("Span: {:.1f} s".format(last_time - first_time))
+    for kind, name in ((READINGS, "readings"), (POWER, "power readings"), (PREDICTION, "predictions")):
+        print(name + ":", counts.get(kind, 0))
+
+
+if __name__ == '__main__':
+    main()
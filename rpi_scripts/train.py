@@ -0,0 +1,209 @@
+"""Trains the classifiers RpiMLClient loads and writes them as versioned artifacts with a metadata record.
+
+Features are extracted per training chunk in a process pool (through the feature cache), cross validation folds
+run in parallel, grouped by recording session so overlapping frames of one session never sit on both sides of a
+split. Every model is then fitted on all data and saved as trained_models/<name>_v<N>.sav, with the flat
+<name>_v<N>.drm RpiMLClient maps at startup and <name>_v<N>.json holding its frame parameters, feature version,
+accuracy and inference latency. -f picks the FeatureBank groups (default: the statistics of extract_batch);
+RpiMLClient reads them back from the metadata.
+
+Usage (from rpi_scripts/): python train.py [-d "training_data/*.npy" | -d training_data/consolidated] [-m rf knn]
+                                           [-f stats band_energy jerk ...]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GroupKFold, cross_val_score
+from sklearn.neighbors import KNeighborsClassifier
+
+from dataset import TrainingDataset, parse_chunk_name
+from drangler.CompiledModel import compile_model, save_compiled
+from drangler.FeatureCache import DEFAULT_CACHE_DIR, FeatureCache, extractor_fingerprint
+from drangler.FeatureExtractor import DEFAULT_FEATURE_GROUPS, FEATURE_GROUPS, FeatureBank
+
+try:
+    from sklearn.externals import joblib
+except ImportError:  # sklearn >= 0.23 dropped the vendored copy
+    import joblib
+
+
+def make_model(name, args):
+    if name == 'rf':
+        return RandomForestClassifier(n_estimators=args.trees, max_depth=args.max_depth, random_state=args.seed)
+    if name == 'knn':
+        return KNeighborsClassifier(n_neighbors=args.neighbors)
+    raise ValueError("Unknown model " + name)
+
+
+# Work items are ('file', chunk path) or ('store', store directory, session index); each worker keeps its own cache,
+# opened without a sweep since load_features sweeps the shared directory once before starting them
+worker_cache = None
+worker_bank = None
+
+
+def init_worker(cache_dir, groups):
+    global worker_cache, worker_bank
+    worker_bank = FeatureBank(groups)
+    worker_cache = FeatureCache(cache_dir, extractor=worker_bank, sweep=False) if cache_dir else None
+
+
+def extract_item(item):
+    frames = numpy.load(item[1]) if item[0] == 'file' else TrainingDataset(item[1]).session(item[2])
+    return worker_cache.features(frames) if worker_cache is not None else worker_bank(frames)
+
+
+def list_items(source, include_incomplete):
+    """Returns work items with their label, session name and (frame_length, sampling_interval, overlap)"""
+    items = []
+    if os.path.isdir(source):
+        dataset = TrainingDataset(source)
+        for session, session_name in enumerate(dataset.session_names):
+            label = int(dataset.labels[dataset.range_of(dataset.sessions, session)[0]])
+            items.append((('store', source, session), label, session_name, dataset.session_params(session)))
+        return items
+    for file_name in sorted(glob.glob(source)):
+        info = parse_chunk_name(file_name)
+        if info is None or (info['incomplete'] and not include_incomplete):
+            continue
+        items.append((('file', file_name), info['label'], info['session'] + "_" + info['move'],
+                      (info['frame_length'], info['sampling_interval'], info['overlap'])))
+    return items
+
+
+def load_features(items, processes, cache_dir, groups=DEFAULT_FEATURE_GROUPS):
+    if cache_dir:
+        FeatureCache(cache_dir, extractor=FeatureBank(groups))  # Removes stale entries before the workers open it
+    with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(cache_dir, groups)) as pool:
+        matrices = list(pool.map(extract_item, [item[0] for item in items], chunksize=4))
+    features = numpy.concatenate(matrices)
+    labels = numpy.concatenate([numpy.full(len(matrix), item[1]) for matrix, item in zip(matrices, items)])
+    session_ids = {session_name: index for index, session_name in enumerate(sorted(set(item[2] for item in items)))}
+    sessions = numpy.concatenate([numpy.full(len(matrix), session_ids[item[2]]) for matrix, item in zip(matrices, items)])
+    return features, labels, sessions
+
+
+def measure_latency(model, features, rows=300):
+    """Single row predict + probabilities latency in ms, through the compiled path RpiMLClient uses"""
+    compiled_model = compile_model(model)
+    sample = features[numpy.random.RandomState(0).choice(len(features), min(rows, len(features)), replace=False)]
+    timings = []
+    for row in sample:
+        start_time = time.perf_counter()
+        compiled_model.predict(row)
+        timings.append(time.perf_counter() - start_time)
+    timings = numpy.array(timings) * 1000.0
+    return {
+        'compiled_path': type(compiled_model).__name__,
+        'mean_ms': float(numpy.mean(timings)),
+        'p50_ms': float(numpy.percentile(timings, 50)),
+        'p95_ms': float(numpy.percentile(timings, 95)),
+    }
+
+
+def next_version(output_dir, name):
+    versions = [int(match.group(1)) for match in
+                (re.match(re.escape(name) + r'_v(\d+)\.sav$', file_name) for file_name in os.listdir(output_dir))
+                if match is not None]
+    return max(versions, default=0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trains the move classifiers with cross validation")
+    parser.add_argument('-d', '--data', default="training_data/*.npy",
+                        help="Glob of training data chunks, or a dataset.py store directory")
+    parser.add_argument('-m', '--models', nargs='+', default=['rf', 'knn'], choices=['rf', 'knn'])
+    parser.add_argument('-o', '--output_dir', default="trained_models", help="Where model artifacts are written")
+    parser.add_argument('-n', '--name', default="trained_model", help="Artifact name prefix, e.g. trained_model_rf")
+    parser.add_argument('-k', '--folds', type=int, default=5, help="Cross validation folds (grouped by session)")
+    parser.add_argument('-j', '--processes', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('-c', '--cache_dir', default=DEFAULT_CACHE_DIR, help="Feature cache directory, '' for none")
+    parser.add_argument('-f', '--features', nargs='+', default=list(DEFAULT_FEATURE_GROUPS),
+                        choices=sorted(FEATURE_GROUPS), help="Feature groups to extract (the per-frame cost of each is printed)")
+    parser.add_argument('--include_incomplete', action='store_true', help="Also train on *_incomplete chunks")
+    parser.add_argument('--trees', type=int, default=100, help="Random forest trees")
+    parser.add_argument('--max_depth', type=int, default=None, help="Random forest depth limit")
+    parser.add_argument('--neighbors', type=int, default=5, help="KNN neighbours")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    items = list_items(args.data, args.include_incomplete)
+    if not items:
+        raise SystemExit("No training data found at " + args.data)
+    frame_params = sorted(set(item[3] for item in items))
+    if len(set((frame_length, overlap) for frame_length, _, overlap in frame_params)) > 1:
+        raise SystemExit("Training data mixes frame lengths / overlaps, select one with -d: " + str(frame_params))
+
+    feature_bank = FeatureBank(args.features)
+    item = items[0][0]
+    sample = numpy.load(item[1]) if item[0] == 'file' else TrainingDataset(item[1]).session(item[2])
+    feature_timing = {group: seconds * 1000.0 for group, seconds in feature_bank.timings(sample[:256]).items()}
+    print("Feature extraction ms per frame:",
+          ", ".join(group + " " + str(round(ms, 4)) for group, ms in feature_timing.items()))
+
+    start_time = time.perf_counter()
+    features, labels, sessions = load_features(items, args.processes, args.cache_dir, feature_bank.groups)
+    print("Extracted", features.shape, "features from", len(items), "chunks in",
+          round(time.perf_counter() - start_time, 2), "s")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = []
+    for model_name in args.models:
+        start_time = time.perf_counter()
+        folds = GroupKFold(n_splits=min(args.folds, len(set(sessions))))
+        scores = cross_val_score(make_model(model_name, args), features, labels, groups=sessions, cv=folds,
+                                 n_jobs=args.processes if args.processes is not None else -1)
+        model = make_model(model_name, args).fit(features, labels)
+        train_time = time.perf_counter() - start_time
+        latency = measure_latency(model, features)
+
+        artifact_name = args.name + "_" + model_name
+        version = next_version(args.output_dir, artifact_name)
+        model_path = os.path.join(args.output_dir, artifact_name + "_v" + str(version) + ".sav")
+        joblib.dump(model, model_path)
+        save_compiled(compile_model(model), os.path.splitext(model_path)[0] + ".drm")  # Fast start for RpiMLClient
+        metadata = {
+            'model': model_name,
+            'version': version,
+            'artifact': os.path.basename(model_path),
+            'params': {key: value for key, value in model.get_params().items()
+                       if isinstance(value, (int, float, str, bool, type(None)))},
+            'frame_length': frame_params[0][0],
+            'sampling_intervals': sorted(set(sampling_interval for _, sampling_interval, _ in frame_params)),
+            'overlap': frame_params[0][2],
+            'feature_version': extractor_fingerprint(feature_bank),
+            'feature_groups': list(feature_bank.groups),
+            'feature_timing_ms': feature_timing,
+            'n_features': int(features.shape[1]),
+            'n_frames': int(len(features)),
+            'n_sessions': int(len(set(sessions))),
+            'classes': [int(label) for label in model.classes_],
+            'cv_folds': len(scores),
+            'cv_accuracy_mean': float(numpy.mean(scores)),
+            'cv_accuracy_std': float(numpy.std(scores)),
+            'latency': latency,
+            'train_seconds': train_time,
+            'data': args.data,
+            'sklearn_version': sklearn.__version__,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(os.path.join(args.output_dir, artifact_name + "_v" + str(version) + ".json"), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        summary.append(metadata)
+
+    print("{:<32} {:>12} {:>10} {:>10}".format("artifact", "cv accuracy", "p50 ms", "p95 ms"))
+    for metadata in sorted(summary, key=lambda metadata: metadata['latency']['p50_ms']):
+        print("{:<32} {:>6.3f}±{:<5.3f} {:>10.4f} {:>10.4f}".format(
+            metadata['artifact'], metadata['cv_accuracy_mean'], metadata['cv_accuracy_std'],
+            metadata['latency']['p50_ms'], metadata['latency']['p95_ms']))
+
+
+if __name__ == '__main__':
+    main()